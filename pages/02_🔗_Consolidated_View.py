@@ -1,14 +1,11 @@
 import streamlit as st
-import requests
-import pandas as pd
-import plotly.express as px
 import plotly.graph_objects as go
 from datetime import datetime, timedelta
-import json
+from utils.data_helpers import ICB_COLUMNS, fetch_raw_data, top_k
 
 # Import Claude integration
 try:
-    from utils.claude_integration import render_claude_sidebar
+    from utils.claude_integration import render_claude_sidebar, register_df
     claude_available = True
 except ImportError:
     claude_available = False
@@ -27,20 +24,16 @@ else:
 st.title("🔗 Consolidated NHS Data View")
 st.subheader("Your Unified Interface to NHS Data")
 
-# Helper functions for API calls
-@st.cache_data(ttl=3600)  # Cache for 1 hour
-def get_openprescribing_data(endpoint, params=None):
-    """Fetch data from OpenPrescribing API"""
-    base_url = "https://openprescribing.net/api/1.0"
-    url = f"{base_url}/{endpoint}"
-    
-    try:
-        response = requests.get(url, params=params, timeout=10)
-        response.raise_for_status()
-        return response.json()
-    except requests.exceptions.RequestException as e:
-        st.error(f"Error fetching data: {str(e)}")
-        return None
+# Common NHS drugs for suggestions (lowercase), with a set for exact-match lookups
+COMMON_DRUGS = (
+    'adalimumab', 'infliximab', 'rituximab', 'trastuzumab', 'omalizumab',
+    'metformin', 'insulin', 'atorvastatin', 'simvastatin', 'ramipril',
+    'amlodipine', 'sertraline', 'fluoxetine', 'citalopram', 'paracetamol',
+    'ibuprofen', 'omeprazole', 'lansoprazole', 'salbutamol', 'prednisolone',
+    'amoxicillin', 'ciprofloxacin', 'warfarin', 'clopidogrel', 'morphine',
+    'tramadol', 'lorazepam', 'diazepam', 'levothyroxine', 'metronidazole'
+)
+COMMON_DRUGS_SET = frozenset(COMMON_DRUGS)
 
 @st.cache_data(ttl=3600)
 def search_drugs(query):
@@ -48,6 +41,10 @@ def search_drugs(query):
     if not query or len(query) < 2:
         return []
     
+    # Known drugs are always prescribed in primary care, so skip the probe
+    if query.lower() in COMMON_DRUGS_SET:
+        return [(query.title(), query.lower(), "Found in OpenPrescribing")]
+    
     # Test if the drug exists in OpenPrescribing by trying to get data
     test_data = get_total_spending_trend(query, months=1)
     if not test_data.empty:
@@ -68,7 +65,13 @@ def search_drugs(query):
     
     return []
 
-@st.cache_data(ttl=3600)
+def last_n_months(df, months):
+    """Slice a frame with a parsed date column down to the last N months"""
+    if 'date' not in df.columns:
+        return df
+    cutoff_date = datetime.now() - timedelta(days=months*30)
+    return df[df['date'] >= cutoff_date]
+
 def get_total_spending_trend(drug_name, months=24):
     """Get total spending trend for a drug by name"""
     params = {
@@ -76,20 +79,13 @@ def get_total_spending_trend(drug_name, months=24):
         'format': 'json'
     }
     
-    data = get_openprescribing_data('spending', params)
-    if data and len(data) > 0:
-        df = pd.DataFrame(data)
-        if not df.empty and 'date' in df.columns:
-            df['date'] = pd.to_datetime(df['date'])
-            df = df.sort_values('date')
-            # Get last N months
-            cutoff_date = datetime.now() - timedelta(days=months*30)
-            df = df[df['date'] >= cutoff_date]
-        return df
-    
-    return pd.DataFrame()
+    # Network fetch is cached once per drug; every window is a slice of it
+    df = last_n_months(fetch_raw_data('spending', params), months)
+    # The API returns rows chronologically, so only sort when that doesn't hold
+    if 'date' in df.columns and not df['date'].is_monotonic_increasing:
+        df = df.sort_values('date')
+    return df
 
-@st.cache_data(ttl=3600)
 def get_drug_spending_by_icb(drug_name, months=12):
     """Get drug spending by ICB by name"""
     params = {
@@ -98,17 +94,7 @@ def get_drug_spending_by_icb(drug_name, months=12):
         'format': 'json'
     }
     
-    data = get_openprescribing_data('spending_by_org', params)
-    if data and len(data) > 0:
-        df = pd.DataFrame(data)
-        if not df.empty and 'date' in df.columns:
-            df['date'] = pd.to_datetime(df['date'])
-            # Get last N months
-            cutoff_date = datetime.now() - timedelta(days=months*30)
-            df = df[df['date'] >= cutoff_date]
-        return df
-        
-    return pd.DataFrame()
+    return last_n_months(fetch_raw_data('spending_by_org', params, columns=ICB_COLUMNS), months)
 
 @st.cache_data(ttl=3600)
 def get_drug_suggestions(query):
@@ -116,28 +102,23 @@ def get_drug_suggestions(query):
     if not query or len(query) < 2:
         return []
     
-    # Common NHS drugs for suggestions
-    common_drugs = [
-        'adalimumab', 'infliximab', 'rituximab', 'trastuzumab', 'omalizumab',
-        'metformin', 'insulin', 'atorvastatin', 'simvastatin', 'ramipril',
-        'amlodipine', 'sertraline', 'fluoxetine', 'citalopram', 'paracetamol',
-        'ibuprofen', 'omeprazole', 'lansoprazole', 'salbutamol', 'prednisolone',
-        'amoxicillin', 'ciprofloxacin', 'warfarin', 'clopidogrel', 'morphine',
-        'tramadol', 'lorazepam', 'diazepam', 'levothyroxine', 'metronidazole'
-    ]
-    
     query_lower = query.lower()
+    
+    # An exact hit needs no scan (and the UI hides suggestions for it anyway)
+    if query_lower in COMMON_DRUGS_SET:
+        return [query_lower]
+    
     suggestions = []
     
     # Look for drugs that start with the query
-    for drug_name in common_drugs:
-        if drug_name.lower().startswith(query_lower):
+    for drug_name in COMMON_DRUGS:
+        if drug_name.startswith(query_lower):
             suggestions.append(drug_name)
     
     # If no exact starts, look for drugs that contain the query
     if len(suggestions) < 5:
-        for drug_name in common_drugs:
-            if query_lower in drug_name.lower() and drug_name not in suggestions:
+        for drug_name in COMMON_DRUGS:
+            if query_lower in drug_name and drug_name not in suggestions:
                 suggestions.append(drug_name)
     
     return sorted(suggestions)[:8]
@@ -155,28 +136,32 @@ def get_enhanced_drug_analysis(drug_name, months=36):
     # 1. Extended trend data (3 years)
     trend_df = get_total_spending_trend(drug_name, months=months)
     if not trend_df.empty:
+        # Pull the columns out once and index the arrays directly
+        costs = trend_df['actual_cost'].to_numpy() if 'actual_cost' in trend_df.columns else None
+        items = trend_df['items'].to_numpy() if 'items' in trend_df.columns else None
+        
         analysis["trend_data"] = {
             "months_of_data": len(trend_df),
             "date_range": f"{trend_df['date'].min().strftime('%Y-%m')} to {trend_df['date'].max().strftime('%Y-%m')}",
-            "latest_cost": float(trend_df['actual_cost'].iloc[-1]) if 'actual_cost' in trend_df.columns else 0,
-            "latest_items": float(trend_df['items'].iloc[-1]) if 'items' in trend_df.columns else 0
+            "latest_cost": float(costs[-1]) if costs is not None else 0,
+            "latest_items": float(items[-1]) if items is not None else 0
         }
         
         # Calculate trend metrics
-        if len(trend_df) >= 2 and 'actual_cost' in trend_df.columns:
-            recent_cost = trend_df['actual_cost'].iloc[-1]
-            previous_cost = trend_df['actual_cost'].iloc[-2]
+        if len(trend_df) >= 2 and costs is not None:
+            recent_cost = float(costs[-1])
+            previous_cost = float(costs[-2])
             analysis["trend_data"]["mom_change_pct"] = ((recent_cost - previous_cost) / previous_cost) * 100
             
             # Year-over-year if available
             if len(trend_df) >= 12:
-                yoy_cost = trend_df['actual_cost'].iloc[-13]
+                yoy_cost = float(costs[-13])
                 analysis["trend_data"]["yoy_change_pct"] = ((recent_cost - yoy_cost) / yoy_cost) * 100
             
             # Overall trend direction
             if len(trend_df) >= 6:
-                recent_avg = trend_df['actual_cost'].tail(6).mean()
-                older_avg = trend_df['actual_cost'].head(6).mean()
+                recent_avg = costs[-6:].mean()
+                older_avg = costs[:6].mean()
                 trend_direction = "increasing" if recent_avg > older_avg * 1.1 else "decreasing" if recent_avg < older_avg * 0.9 else "stable"
                 analysis["trend_data"]["overall_trend"] = trend_direction
         
@@ -186,10 +171,10 @@ def get_enhanced_drug_analysis(drug_name, months=36):
     icb_df = get_drug_spending_by_icb(drug_name, months=12)
     if not icb_df.empty and 'row_name' in icb_df.columns:
         # Group by ICB and calculate totals
-        icb_summary = icb_df.groupby('row_name').agg({
-            'actual_cost': 'sum',
-            'items': 'sum'
-        }).reset_index()
+        icb_summary = icb_df.groupby('row_name', sort=False, observed=True).agg(
+            actual_cost=('actual_cost', 'sum'),
+            items=('items', 'sum')
+        ).reset_index()
         
         if not icb_summary.empty:
             analysis["regional_data"] = {
@@ -236,6 +221,194 @@ def get_enhanced_drug_analysis(drug_name, months=36):
     
     return analysis
 
+# Chart builders - cached as resources so reruns reuse the Figure instead of rebuilding it
+@st.cache_resource(ttl=3600)
+def build_spending_fig(search_term, drug_name, months=12):
+    """Build the monthly spending line chart for a drug"""
+    spending_df = get_total_spending_trend(search_term, months=months)
+    fig = go.Figure(go.Scatter(
+        x=spending_df['date'].to_numpy(),
+        y=spending_df['actual_cost'].to_numpy(dtype='float32'),
+        mode='lines'
+    ))
+    fig.update_layout(
+        title=f"Monthly Spending Trend - {drug_name}",
+        xaxis_title="Date",
+        yaxis_title="Cost (£)",
+        height=400
+    )
+    return fig
+
+@st.cache_resource(ttl=3600)
+def build_icb_fig(search_term, drug_name, months=6):
+    """Build the top 10 ICBs bar chart for a drug"""
+    icb_df = get_drug_spending_by_icb(search_term, months=months)
+    icb_summary = icb_df.groupby('row_name', sort=False, observed=True).agg(
+        actual_cost=('actual_cost', 'sum')
+    ).reset_index()
+    top_icbs = top_k(icb_summary, 'actual_cost', 10)
+    
+    fig = go.Figure(go.Bar(
+        x=top_icbs['actual_cost'].to_numpy(dtype='float32'),
+        y=top_icbs['row_name'].to_numpy(),
+        orientation='h'
+    ))
+    fig.update_layout(
+        title=f"Top 10 ICBs by {drug_name} Spending (Last {months} months)",
+        xaxis_title="Total Cost (£)",
+        yaxis_title="ICB",
+        height=500
+    )
+    return fig
+
+@st.cache_resource(ttl=3600)
+def build_trend_fig(search_term, drug_name, months=24):
+    """Build the cost vs volume dual-axis chart for a drug"""
+    trend_df = get_total_spending_trend(search_term, months=months)
+    fig = go.Figure()
+    
+    if 'actual_cost' in trend_df.columns:
+        fig.add_trace(go.Scatter(
+            x=trend_df['date'],
+            y=trend_df['actual_cost'].to_numpy(dtype='float32'),
+            mode='lines+markers',
+            name='Cost (£)',
+            yaxis='y'
+        ))
+    
+    if 'items' in trend_df.columns:
+        fig.add_trace(go.Scatter(
+            x=trend_df['date'],
+            y=trend_df['items'],
+            mode='lines+markers',
+            name='Items',
+            yaxis='y2'
+        ))
+    
+    fig.update_layout(
+        title=f"{drug_name} - Cost vs Volume Trend",
+        xaxis_title="Date",
+        yaxis=dict(title="Cost (£)", side="left"),
+        yaxis2=dict(title="Number of Items", side="right", overlaying="y"),
+        height=400
+    )
+    return fig
+
+# Tab bodies - fragments so widget interactions inside a tab only rerun that tab
+@st.fragment
+def render_overview_tab(search_term, drug_name, trend_df):
+    """Render the Spending Overview tab"""
+    st.subheader(f"💰 {drug_name} Spending Overview")
+    
+    # Get recent spending data
+    spending_df = last_n_months(trend_df, 12)
+    
+    # Store data for Claude context
+    if not spending_df.empty:
+        st.session_state.current_spending_data = spending_df
+        if claude_available:
+            register_df('current_spending_data', spending_df)
+    
+    if not spending_df.empty:
+        # Pull the columns out once and index the arrays directly
+        costs = spending_df['actual_cost'].to_numpy() if 'actual_cost' in spending_df.columns else None
+        items = spending_df['items'].to_numpy() if 'items' in spending_df.columns else None
+        
+        # Key metrics
+        col1, col2, col3 = st.columns(3)
+        
+        with col1:
+            latest_cost = float(costs[-1]) if costs is not None else 0
+            st.metric("Latest Monthly Cost", f"£{latest_cost:,.0f}")
+        
+        with col2:
+            total_items = int(items[-1]) if items is not None else 0
+            st.metric("Latest Monthly Items", f"{total_items:,.0f}")
+        
+        with col3:
+            if costs is not None and len(costs) >= 2:
+                prev_cost = float(costs[-2])
+                current_cost = float(costs[-1])
+                change = ((current_cost - prev_cost) / prev_cost) * 100
+                st.metric("Month-on-Month Change", f"{change:+.1f}%")
+            else:
+                st.metric("Month-on-Month Change", "N/A")
+        
+        # Spending trend chart
+        if 'date' in spending_df.columns and 'actual_cost' in spending_df.columns:
+            st.plotly_chart(build_spending_fig(search_term, drug_name, 12), use_container_width=True)
+    else:
+        st.warning("No recent spending data available for this drug.")
+
+@st.fragment
+def render_regional_tab(search_term, drug_name):
+    """Render the Regional Analysis tab"""
+    st.subheader(f"🗺️ {drug_name} by ICB")
+    
+    # Get ICB spending data
+    icb_df = get_drug_spending_by_icb(search_term, months=6)
+    
+    # Store ICB data for Claude context
+    if not icb_df.empty and 'row_name' in icb_df.columns:
+        st.session_state.current_icb_data = icb_df
+        if claude_available:
+            register_df('current_icb_data', icb_df)
+    
+    if not icb_df.empty and 'row_name' in icb_df.columns:
+        # Group by ICB and sum recent spending
+        icb_summary = icb_df.groupby('row_name', sort=False, observed=True).agg(
+            actual_cost=('actual_cost', 'sum'),
+            items=('items', 'sum')
+        ).reset_index()
+        
+        # Top spending ICBs
+        st.plotly_chart(build_icb_fig(search_term, drug_name, 6), use_container_width=True)
+        
+        # Show data table - formatting is deferred to the Styler so columns stay numeric
+        st.subheader("📋 ICB Spending Data")
+        st.dataframe(
+            icb_summary.style.format({'actual_cost': '£{:,.0f}', 'items': '{:,.0f}'}),
+            use_container_width=True,
+            column_config={
+                'row_name': 'ICB Name',
+                'actual_cost': 'Total Cost',
+                'items': 'Total Items'
+            }
+        )
+        
+    else:
+        st.warning("No ICB data available for this drug.")
+
+@st.fragment
+def render_trends_tab(search_term, drug_name, trend_df):
+    """Render the Trends tab"""
+    st.subheader(f"📈 {drug_name} Trends & Analysis")
+    
+    if not trend_df.empty and 'date' in trend_df.columns:
+        # Items vs Cost trend
+        st.plotly_chart(build_trend_fig(search_term, drug_name, 24), use_container_width=True)
+        
+        # Basic analysis
+        st.markdown("### 🔍 Quick Analysis")
+        
+        if 'actual_cost' in trend_df.columns and len(trend_df) >= 12:
+            # Calculate some basic trends
+            costs = trend_df['actual_cost'].to_numpy()
+            recent_6m = float(costs[-6:].mean())
+            previous_6m = float(costs[-12:-6].mean())
+            cost_trend = ((recent_6m - previous_6m) / previous_6m) * 100
+            
+            if cost_trend > 5:
+                st.warning(f"📈 **Increasing costs**: Spending has increased by {cost_trend:.1f}% over the last 6 months")
+            elif cost_trend < -5:
+                st.success(f"📉 **Decreasing costs**: Spending has decreased by {abs(cost_trend):.1f}% over the last 6 months")
+            else:
+                st.info(f"📊 **Stable costs**: Spending has remained relatively stable (±{abs(cost_trend):.1f}%)")
+        
+    else:
+        st.warning("Insufficient trend data available for analysis.")
+
+
 # Cache management
 col1, col2 = st.columns([3, 1])
 with col1:
@@ -245,6 +418,9 @@ with col2:
     st.markdown("<br>", unsafe_allow_html=True)  # Add space
     if st.button("🔄 Clear Cache", help="Refresh all cached data"):
         st.cache_data.clear()
+        # The charts are cached as resources, so they need clearing too or they'd show pre-refresh data
+        for build_fig in (build_spending_fig, build_icb_fig, build_trend_fig):
+            build_fig.clear()
         st.success("Cache cleared! Data will be refreshed on next search.")
 
 # Drug search interface
@@ -373,152 +549,20 @@ DATA SOURCES:
             with col2:
                 st.info(f"**Source:** {data_source}")
             
+            # Fetch the 24-month trend once; the 12-month overview is a slice of it
+            trend_df = get_total_spending_trend(search_term, months=24)
+            
             # Create tabs for different views
             tab1, tab2, tab3 = st.tabs(["📊 Spending Overview", "🗺️ Regional Analysis", "📈 Trends"])
             
             with tab1:
-                st.subheader(f"💰 {drug_name} Spending Overview")
-                
-                # Get recent spending data
-                spending_df = get_total_spending_trend(search_term, months=12)
-                
-                # Store data for Claude context
-                if not spending_df.empty:
-                    st.session_state.current_spending_data = spending_df
-                
-                if not spending_df.empty:
-                    # Key metrics
-                    col1, col2, col3 = st.columns(3)
-                    
-                    with col1:
-                        latest_cost = spending_df['actual_cost'].iloc[-1] if 'actual_cost' in spending_df.columns else 0
-                        st.metric("Latest Monthly Cost", f"£{latest_cost:,.0f}")
-                    
-                    with col2:
-                        total_items = spending_df['items'].iloc[-1] if 'items' in spending_df.columns else 0
-                        st.metric("Latest Monthly Items", f"{total_items:,.0f}")
-                    
-                    with col3:
-                        if len(spending_df) >= 2 and 'actual_cost' in spending_df.columns:
-                            prev_cost = spending_df['actual_cost'].iloc[-2]
-                            current_cost = spending_df['actual_cost'].iloc[-1]
-                            change = ((current_cost - prev_cost) / prev_cost) * 100
-                            st.metric("Month-on-Month Change", f"{change:+.1f}%")
-                        else:
-                            st.metric("Month-on-Month Change", "N/A")
-                    
-                    # Spending trend chart
-                    if 'date' in spending_df.columns and 'actual_cost' in spending_df.columns:
-                        fig = px.line(
-                            spending_df, 
-                            x='date', 
-                            y='actual_cost',
-                            title=f"Monthly Spending Trend - {drug_name}",
-                            labels={'actual_cost': 'Cost (£)', 'date': 'Date'}
-                        )
-                        fig.update_layout(height=400)
-                        st.plotly_chart(fig, use_container_width=True)
-                else:
-                    st.warning("No recent spending data available for this drug.")
+                render_overview_tab(search_term, drug_name, trend_df)
             
             with tab2:
-                st.subheader(f"🗺️ {drug_name} by ICB")
-                
-                # Get ICB spending data
-                icb_df = get_drug_spending_by_icb(search_term, months=6)
-                
-                # Store ICB data for Claude context
-                if not icb_df.empty and 'row_name' in icb_df.columns:
-                    st.session_state.current_icb_data = icb_df
-                
-                if not icb_df.empty and 'row_name' in icb_df.columns:
-                    # Group by ICB and sum recent spending
-                    icb_summary = icb_df.groupby('row_name').agg({
-                        'actual_cost': 'sum',
-                        'items': 'sum'
-                    }).reset_index()
-                    
-                    # Top spending ICBs
-                    top_icbs = icb_summary.nlargest(10, 'actual_cost')
-                    
-                    fig = px.bar(
-                        top_icbs,
-                        x='actual_cost',
-                        y='row_name',
-                        orientation='h',
-                        title=f"Top 10 ICBs by {drug_name} Spending (Last 6 months)",
-                        labels={'actual_cost': 'Total Cost (£)', 'row_name': 'ICB'}
-                    )
-                    fig.update_layout(height=500)
-                    st.plotly_chart(fig, use_container_width=True)
-                    
-                    # Show data table
-                    st.subheader("📋 ICB Spending Data")
-                    display_df = icb_summary.copy()
-                    display_df['actual_cost'] = display_df['actual_cost'].apply(lambda x: f"£{x:,.0f}")
-                    display_df['items'] = display_df['items'].apply(lambda x: f"{x:,.0f}")
-                    display_df.columns = ['ICB Name', 'Total Cost', 'Total Items']
-                    st.dataframe(display_df, use_container_width=True)
-                    
-                else:
-                    st.warning("No ICB data available for this drug.")
+                render_regional_tab(search_term, drug_name)
             
             with tab3:
-                st.subheader(f"📈 {drug_name} Trends & Analysis")
-                
-                # Get longer trend data
-                trend_df = get_total_spending_trend(search_term, months=24)
-                
-                if not trend_df.empty and 'date' in trend_df.columns:
-                    # Items vs Cost trend
-                    fig = go.Figure()
-                    
-                    if 'actual_cost' in trend_df.columns:
-                        fig.add_trace(go.Scatter(
-                            x=trend_df['date'],
-                            y=trend_df['actual_cost'],
-                            mode='lines+markers',
-                            name='Cost (£)',
-                            yaxis='y'
-                        ))
-                    
-                    if 'items' in trend_df.columns:
-                        fig.add_trace(go.Scatter(
-                            x=trend_df['date'],
-                            y=trend_df['items'],
-                            mode='lines+markers',
-                            name='Items',
-                            yaxis='y2'
-                        ))
-                    
-                    fig.update_layout(
-                        title=f"{drug_name} - Cost vs Volume Trend",
-                        xaxis_title="Date",
-                        yaxis=dict(title="Cost (£)", side="left"),
-                        yaxis2=dict(title="Number of Items", side="right", overlaying="y"),
-                        height=400
-                    )
-                    
-                    st.plotly_chart(fig, use_container_width=True)
-                    
-                    # Basic analysis
-                    st.markdown("### 🔍 Quick Analysis")
-                    
-                    if 'actual_cost' in trend_df.columns and len(trend_df) >= 12:
-                        # Calculate some basic trends
-                        recent_6m = trend_df.tail(6)['actual_cost'].mean()
-                        previous_6m = trend_df.iloc[-12:-6]['actual_cost'].mean()
-                        cost_trend = ((recent_6m - previous_6m) / previous_6m) * 100
-                        
-                        if cost_trend > 5:
-                            st.warning(f"📈 **Increasing costs**: Spending has increased by {cost_trend:.1f}% over the last 6 months")
-                        elif cost_trend < -5:
-                            st.success(f"📉 **Decreasing costs**: Spending has decreased by {abs(cost_trend):.1f}% over the last 6 months")
-                        else:
-                            st.info(f"📊 **Stable costs**: Spending has remained relatively stable (±{abs(cost_trend):.1f}%)")
-                    
-                else:
-                    st.warning("Insufficient trend data available for analysis.")
+                render_trends_tab(search_term, drug_name, trend_df)
                     
         else:
             st.error(f"❌ No prescribing data found for '{query}'. This drug may not be prescribed in primary care or the name might need adjustment.")
@@ -2,14 +2,13 @@ import streamlit as st
 import pandas as pd
 import plotly.express as px
 import plotly.graph_objects as go
-from plotly.subplots import make_subplots
-import requests
 from datetime import datetime, timedelta
 import numpy as np
+from utils.data_helpers import ICB_COLUMNS, NUMERIC_DTYPES, fetch_raw_data, get_openprescribing_data, top_k
 
 # Import Claude integration
 try:
-    from utils.claude_integration import render_claude_sidebar
+    from utils.claude_integration import render_claude_sidebar, register_df
     claude_available = True
 except ImportError:
     claude_available = False
@@ -53,62 +52,51 @@ st.markdown("""
 """, unsafe_allow_html=True)
 
 @st.cache_data(ttl=3600)
-def get_openprescribing_data(endpoint, params=None):
-    """Fetch data from OpenPrescribing API"""
-    base_url = "https://openprescribing.net/api/1.0"
-    url = f"{base_url}/{endpoint}"
-    
-    try:
-        response = requests.get(url, params=params, timeout=10)
-        response.raise_for_status()
-        return response.json()
-    except requests.exceptions.RequestException as e:
-        st.error(f"Error fetching data: {str(e)}")
-        return None
-
-@st.cache_data(ttl=3600)
-def get_high_cost_drugs_data():
-    """Get data for high-cost biologics"""
+def fetch_high_cost_raw():
+    """Fetch spending rows for all high-cost biologics into a single DataFrame"""
     high_cost_drugs = ['adalimumab', 'infliximab', 'rituximab', 'trastuzumab', 'omalizumab']
-    all_data = []
+    rows = []
     
+    # Tag the raw JSON rows and build one frame, rather than one frame per drug
     for drug in high_cost_drugs:
         params = {'q': drug, 'format': 'json'}
         data = get_openprescribing_data('spending', params)
-        if data:
-            df = pd.DataFrame(data)
-            if not df.empty:
-                df['drug_name'] = drug.title()
-                df['date'] = pd.to_datetime(df['date'])
-                # Get last 12 months
-                cutoff_date = datetime.now() - timedelta(days=365)
-                df = df[df['date'] >= cutoff_date]
-                all_data.append(df)
+        rows.extend({**row, 'drug_name': drug.title()} for row in data or [])
     
-    if all_data:
-        return pd.concat(all_data, ignore_index=True)
+    if rows:
+        df = pd.DataFrame(rows)
+        df = df.astype({c: t for c, t in NUMERIC_DTYPES.items() if c in df.columns})
+        df['drug_name'] = df['drug_name'].astype('category')
+        df['date'] = pd.to_datetime(df['date'], format='%Y-%m-%d', cache=True)
+        return df
     return pd.DataFrame()
 
-@st.cache_data(ttl=3600)
+def get_high_cost_drugs_data():
+    """Get data for high-cost biologics"""
+    df = fetch_high_cost_raw()
+    if not df.empty:
+        # Get last 12 months
+        cutoff_date = datetime.now() - timedelta(days=365)
+        df = df[df['date'] >= cutoff_date].reset_index(drop=True)
+    return df
+
 def get_biosimilar_analysis():
     """Analyze biosimilar adoption for key drugs"""
     # Focus on adalimumab as an example
     params = {'q': 'adalimumab', 'format': 'json'}
-    data = get_openprescribing_data('spending', params)
+    df = fetch_raw_data('spending', params)
     
-    if data:
-        df = pd.DataFrame(data)
-        if not df.empty and 'date' in df.columns:
-            df['date'] = pd.to_datetime(df['date'])
+    if not df.empty and 'date' in df.columns:
+        # Get last 24 months for trend analysis
+        cutoff_date = datetime.now() - timedelta(days=730)
+        df = df[df['date'] >= cutoff_date]
+        # The API returns rows chronologically, so only sort when that doesn't hold
+        if not df['date'].is_monotonic_increasing:
             df = df.sort_values('date')
-            # Get last 24 months for trend analysis
-            cutoff_date = datetime.now() - timedelta(days=730)
-            df = df[df['date'] >= cutoff_date]
-            return df
+        return df
     
     return pd.DataFrame()
 
-@st.cache_data(ttl=3600)
 def get_icb_performance_data():
     """Get ICB performance comparison"""
     params = {
@@ -117,33 +105,19 @@ def get_icb_performance_data():
         'format': 'json'
     }
     
-    data = get_openprescribing_data('spending_by_org', params)
-    if data:
-        df = pd.DataFrame(data)
-        if not df.empty and 'date' in df.columns:
-            df['date'] = pd.to_datetime(df['date'])
-            # Get last 6 months
-            cutoff_date = datetime.now() - timedelta(days=180)
-            df = df[df['date'] >= cutoff_date]
-            return df
+    df = fetch_raw_data('spending_by_org', params, columns=ICB_COLUMNS)
+    if not df.empty and 'date' in df.columns:
+        # Get last 6 months
+        cutoff_date = datetime.now() - timedelta(days=180)
+        df = df[df['date'] >= cutoff_date]
+        return df
     
     return pd.DataFrame()
 
-# Dashboard Header
-st.markdown("""
-<div class="dashboard-header">
-<h1>📈 NHS Prescribing Analytics Dashboard</h1>
-<p>Real-time insights from NHS prescribing data with AI-powered analysis</p>
-</div>
-""", unsafe_allow_html=True)
-
-# Dashboard selection
-dashboard_type = st.selectbox(
-    "📊 Select Dashboard Type:",
-    ["High-Cost Drug Monitor", "Biosimilar Adoption Tracker", "ICB Performance Comparison", "Prescribing Patterns Analysis"]
-)
-
-if dashboard_type == "High-Cost Drug Monitor":
+# Dashboard bodies - fragments so widget interactions inside a dashboard only rerun that dashboard
+@st.fragment
+def render_high_cost_monitor():
+    """Render the High-Cost Drug Monitor dashboard"""
     st.header("💰 High-Cost Drug Monitor")
     
     with st.spinner("Loading high-cost drug data..."):
@@ -152,17 +126,19 @@ if dashboard_type == "High-Cost Drug Monitor":
     if not high_cost_df.empty:
         # Store data for Claude context
         st.session_state.dashboard_data = high_cost_df
+        if claude_available:
+            register_df('dashboard_data', high_cost_df)
         st.session_state.dashboard_type = "High-Cost Drug Monitor"
         
         # Key metrics
         col1, col2, col3, col4 = st.columns(4)
         
         with col1:
-            total_cost = high_cost_df['actual_cost'].sum()
+            total_cost = float(high_cost_df['actual_cost'].sum())
             st.metric("Total Annual Cost", f"£{total_cost:,.0f}")
         
         with col2:
-            total_items = high_cost_df['items'].sum()
+            total_items = int(high_cost_df['items'].sum())
             st.metric("Total Items", f"{total_items:,.0f}")
         
         with col3:
@@ -177,22 +153,29 @@ if dashboard_type == "High-Cost Drug Monitor":
         col1, col2 = st.columns([2, 1])
         
         with col1:
-            monthly_spending = high_cost_df.groupby(['date', 'drug_name'])['actual_cost'].sum().reset_index()
+            monthly_spending = high_cost_df.groupby(['date', 'drug_name'], observed=True)['actual_cost'].sum().reset_index()
             
-            fig = px.line(
-                monthly_spending,
-                x='date',
-                y='actual_cost',
-                color='drug_name',
+            # One trace per drug built straight from the arrays
+            fig = go.Figure()
+            for drug, grp in monthly_spending.groupby('drug_name', sort=False, observed=True):
+                fig.add_trace(go.Scatter(
+                    x=grp['date'].to_numpy(),
+                    y=grp['actual_cost'].to_numpy(dtype='float32'),
+                    mode='lines',
+                    name=drug
+                ))
+            fig.update_layout(
                 title="Monthly Spending Trends - High-Cost Biologics",
-                labels={'actual_cost': 'Cost (£)', 'date': 'Date', 'drug_name': 'Drug'}
+                xaxis_title="Date",
+                yaxis_title="Cost (£)",
+                legend_title_text="Drug",
+                height=400
             )
-            fig.update_layout(height=400)
             st.plotly_chart(fig, use_container_width=True)
         
         with col2:
             # Drug spending breakdown
-            drug_totals = high_cost_df.groupby('drug_name')['actual_cost'].sum().reset_index()
+            drug_totals = high_cost_df.groupby('drug_name', observed=True)['actual_cost'].sum().reset_index()
             
             fig_pie = px.pie(
                 drug_totals,
@@ -210,35 +193,33 @@ if dashboard_type == "High-Cost Drug Monitor":
         latest_month = high_cost_df['date'].max()
         previous_month = latest_month - timedelta(days=30)
         
-        alerts = []
-        for drug in high_cost_df['drug_name'].unique():
-            drug_data = high_cost_df[high_cost_df['drug_name'] == drug]
-            
-            latest_cost = drug_data[drug_data['date'] == latest_month]['actual_cost'].sum()
-            previous_cost = drug_data[drug_data['date'] >= previous_month]['actual_cost'].sum()
-            
-            if previous_cost > 0:
-                change_pct = ((latest_cost - previous_cost) / previous_cost) * 100
-                if abs(change_pct) > 10:  # Alert if >10% change
-                    alerts.append({
-                        'drug': drug,
-                        'change': change_pct,
-                        'latest_cost': latest_cost
-                    })
-        
-        if alerts:
-            for alert in alerts:
+        # Build both masks once and sum per drug in a single groupby pass
+        m_latest = high_cost_df['date'].eq(latest_month)
+        m_previous = high_cost_df['date'].ge(previous_month)
+        drug_costs = high_cost_df.assign(
+            latest_cost=high_cost_df['actual_cost'].where(m_latest, 0),
+            previous_cost=high_cost_df['actual_cost'].where(m_previous, 0)
+        ).groupby('drug_name', sort=False, observed=True)[['latest_cost', 'previous_cost']].sum()
+
+        drug_costs = drug_costs[drug_costs['previous_cost'] > 0]
+        change_pct = (drug_costs['latest_cost'] - drug_costs['previous_cost']) / drug_costs['previous_cost'] * 100
+        alerts = drug_costs.assign(change=change_pct)[change_pct.abs() > 10]  # Alert if >10% change
+
+        if not alerts.empty:
+            for drug, alert in alerts.iterrows():
                 if alert['change'] > 0:
-                    st.warning(f"📈 **{alert['drug']}**: {alert['change']:+.1f}% increase (£{alert['latest_cost']:,.0f})")
+                    st.warning(f"📈 **{drug}**: {alert['change']:+.1f}% increase (£{alert['latest_cost']:,.0f})")
                 else:
-                    st.success(f"📉 **{alert['drug']}**: {alert['change']:+.1f}% decrease (£{alert['latest_cost']:,.0f})")
+                    st.success(f"📉 **{drug}**: {alert['change']:+.1f}% decrease (£{alert['latest_cost']:,.0f})")
         else:
             st.info("✅ No significant cost changes detected this month")
     
     else:
         st.warning("Unable to load high-cost drug data. Please try again later.")
 
-elif dashboard_type == "Biosimilar Adoption Tracker":
+@st.fragment
+def render_biosimilar_tracker():
+    """Render the Biosimilar Adoption Tracker dashboard"""
     st.header("🧬 Biosimilar Adoption Tracker")
     
     with st.spinner("Analyzing biosimilar adoption..."):
@@ -247,8 +228,14 @@ elif dashboard_type == "Biosimilar Adoption Tracker":
     if not biosimilar_df.empty:
         # Store for Claude context
         st.session_state.dashboard_data = biosimilar_df
+        if claude_available:
+            register_df('dashboard_data', biosimilar_df)
         st.session_state.dashboard_type = "Biosimilar Adoption Tracker"
         
+        # Pull the columns out once and index the arrays directly
+        costs = biosimilar_df['actual_cost'].to_numpy()
+        items = biosimilar_df['items'].to_numpy()
+        
         col1, col2 = st.columns(2)
         
         with col1:
@@ -266,8 +253,8 @@ elif dashboard_type == "Biosimilar Adoption Tracker":
         with col2:
             # Calculate potential savings
             if len(biosimilar_df) >= 12:
-                recent_avg = biosimilar_df.tail(6)['actual_cost'].mean()
-                baseline_avg = biosimilar_df.head(6)['actual_cost'].mean()
+                recent_avg = float(costs[-6:].mean())
+                baseline_avg = float(costs[:6].mean())
                 
                 st.markdown("""
                 <div class="kpi-container">
@@ -292,11 +279,11 @@ elif dashboard_type == "Biosimilar Adoption Tracker":
         col1, col2, col3 = st.columns(3)
         
         with col1:
-            latest_cost = biosimilar_df['actual_cost'].iloc[-1]
+            latest_cost = float(costs[-1])
             st.metric("Latest Monthly Cost", f"£{latest_cost:,.0f}")
         
         with col2:
-            latest_items = biosimilar_df['items'].iloc[-1]
+            latest_items = int(items[-1])
             st.metric("Latest Monthly Items", f"{latest_items:,.0f}")
         
         with col3:
@@ -306,7 +293,9 @@ elif dashboard_type == "Biosimilar Adoption Tracker":
     else:
         st.warning("Unable to load biosimilar data. Please try again later.")
 
-elif dashboard_type == "ICB Performance Comparison":
+@st.fragment
+def render_icb_comparison():
+    """Render the ICB Performance Comparison dashboard"""
     st.header("🗺️ ICB Performance Comparison")
     
     with st.spinner("Loading ICB performance data..."):
@@ -315,13 +304,15 @@ elif dashboard_type == "ICB Performance Comparison":
     if not icb_df.empty and 'row_name' in icb_df.columns:
         # Store for Claude context
         st.session_state.dashboard_data = icb_df
+        if claude_available:
+            register_df('dashboard_data', icb_df)
         st.session_state.dashboard_type = "ICB Performance Comparison"
         
         # Group by ICB
-        icb_summary = icb_df.groupby('row_name').agg({
-            'actual_cost': 'sum',
-            'items': 'sum'
-        }).reset_index()
+        icb_summary = icb_df.groupby('row_name', sort=False, observed=True).agg(
+            actual_cost=('actual_cost', 'sum'),
+            items=('items', 'sum')
+        ).reset_index()
         
         icb_summary['cost_per_item'] = icb_summary['actual_cost'] / icb_summary['items']
         
@@ -329,27 +320,29 @@ elif dashboard_type == "ICB Performance Comparison":
         
         with col1:
             # Top spending ICBs
-            top_icbs = icb_summary.nlargest(15, 'actual_cost')
+            top_icbs = top_k(icb_summary, 'actual_cost', 15)
             
-            fig = px.bar(
-                top_icbs,
-                x='actual_cost',
-                y='row_name',
+            costs = top_icbs['actual_cost'].to_numpy(dtype='float32')
+            fig = go.Figure(go.Bar(
+                x=costs,
+                y=top_icbs['row_name'].to_numpy(),
                 orientation='h',
+                marker=dict(color=costs, colorscale='Blues', colorbar=dict(title='Total Cost (£)'))
+            ))
+            fig.update_layout(
                 title="ICB Spending Comparison - Adalimumab (Last 6 months)",
-                labels={'actual_cost': 'Total Cost (£)', 'row_name': 'ICB'},
-                color='actual_cost',
-                color_continuous_scale='Blues'
+                xaxis_title="Total Cost (£)",
+                yaxis_title="ICB",
+                height=600
             )
-            fig.update_layout(height=600)
             st.plotly_chart(fig, use_container_width=True)
         
         with col2:
             st.subheader("📊 Performance Metrics")
             
             # Calculate benchmarks
-            avg_cost = icb_summary['actual_cost'].mean()
-            median_cost = icb_summary['actual_cost'].median()
+            avg_cost = float(icb_summary['actual_cost'].mean())
+            median_cost = float(icb_summary['actual_cost'].median())
             
             st.metric("Average ICB Cost", f"£{avg_cost:,.0f}")
             st.metric("Median ICB Cost", f"£{median_cost:,.0f}")
@@ -358,7 +351,7 @@ elif dashboard_type == "ICB Performance Comparison":
             st.subheader("⚡ Efficiency Analysis")
             
             # Cost per item analysis
-            avg_cost_per_item = icb_summary['cost_per_item'].mean()
+            avg_cost_per_item = float(icb_summary['cost_per_item'].mean())
             efficient_icbs = icb_summary[icb_summary['cost_per_item'] < avg_cost_per_item * 0.9]
             
             st.metric("Efficient ICBs", f"{len(efficient_icbs)}")
@@ -370,7 +363,13 @@ elif dashboard_type == "ICB Performance Comparison":
         # Performance quartiles
         st.subheader("📈 Performance Quartiles")
         
-        icb_summary['quartile'] = pd.qcut(icb_summary['actual_cost'], 4, labels=['Q1 (Lowest)', 'Q2', 'Q3', 'Q4 (Highest)'])
+        # Same right-closed bins as pd.qcut, assigned with a binary search over the 3 inner edges
+        costs = icb_summary['actual_cost'].to_numpy()
+        edges = np.quantile(costs, [0.25, 0.5, 0.75])
+        icb_summary['quartile'] = pd.Categorical.from_codes(
+            np.searchsorted(edges, costs),
+            ['Q1 (Lowest)', 'Q2', 'Q3', 'Q4 (Highest)']
+        )
         quartile_counts = icb_summary['quartile'].value_counts()
         
         fig_quartiles = px.bar(
@@ -384,7 +383,9 @@ elif dashboard_type == "ICB Performance Comparison":
     else:
         st.warning("Unable to load ICB performance data. Please try again later.")
 
-elif dashboard_type == "Prescribing Patterns Analysis":
+@st.fragment
+def render_prescribing_patterns():
+    """Render the Prescribing Patterns Analysis dashboard"""
     st.header("📋 Prescribing Patterns Analysis")
     
     st.info("🚧 Advanced prescribing pattern analysis coming soon!")
@@ -414,6 +415,33 @@ elif dashboard_type == "Prescribing Patterns Analysis":
        - Trend extrapolation
     """)
 
+# Dashboard Header
+st.markdown("""
+<div class="dashboard-header">
+<h1>📈 NHS Prescribing Analytics Dashboard</h1>
+<p>Real-time insights from NHS prescribing data with AI-powered analysis</p>
+</div>
+""", unsafe_allow_html=True)
+
+# Dashboard selection
+dashboard_type = st.selectbox(
+    "📊 Select Dashboard Type:",
+    ["High-Cost Drug Monitor", "Biosimilar Adoption Tracker", "ICB Performance Comparison", "Prescribing Patterns Analysis"]
+)
+
+if dashboard_type == "High-Cost Drug Monitor":
+    render_high_cost_monitor()
+
+elif dashboard_type == "Biosimilar Adoption Tracker":
+    render_biosimilar_tracker()
+
+elif dashboard_type == "ICB Performance Comparison":
+    render_icb_comparison()
+
+elif dashboard_type == "Prescribing Patterns Analysis":
+    render_prescribing_patterns()
+
+
 # Data export section
 st.markdown("---")
 st.header("💾 Export Dashboard Data")
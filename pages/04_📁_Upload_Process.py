@@ -1,18 +1,39 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
 import io
-import plotly.express as px
-import plotly.graph_objects as go
+import os
+import tempfile
 from datetime import datetime
-import base64
+import hashlib
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+import logging
+import re
+import shutil
+import atexit
+import time
+import threading
+from utils.csv_readers import iter_csv_arrow, read_csv_arrow
 
 # Import Claude integration
 try:
-    from utils.claude_integration import render_claude_sidebar
+    from utils.claude_integration import render_claude_sidebar, register_df, unregister_df
     claude_available = True
 except ImportError:
     claude_available = False
 
+# Numba is optional - without it the monthly rollup uses np.bincount
+try:
+    from numba import njit
+    numba_available = True
+except ImportError:
+    numba_available = False
+
 st.set_page_config(page_title="Upload & Process", page_icon="📁", layout="wide")
 
 # Set current page for Claude context
@@ -24,8 +45,11 @@ if claude_available:
 else:
     st.sidebar.error("Claude integration not available")
 
-# Custom CSS
-st.markdown("""
+# Static markup - built once per process and shared across reruns and sessions
+@st.cache_resource
+def page_css():
+    """Return the page's custom CSS block"""
+    return """
 <style>
 .upload-zone {
     border: 2px dashed #1f77b4;
@@ -50,111 +74,588 @@ st.markdown("""
     margin: 1rem 0;
 }
 </style>
-""", unsafe_allow_html=True)
+"""
 
-def analyze_epact_data(df):
-    """Analyze uploaded ePACT2 data and return insights"""
-    analysis = {
+@st.cache_resource
+def epact_intro_html():
+    """Return the 'What is ePACT2?' info panel"""
+    return """
+<div class="upload-zone">
+<h3>📋 What is ePACT2?</h3>
+<p><strong>ePACT2</strong> is the NHS Business Services Authority's prescription analysis tool that provides detailed prescription-level data for medicines optimization teams.</p>
+<p><strong>This tool helps you:</strong> Upload CSV exports from ePACT2 and get instant AI-powered insights, trend analysis, and actionable recommendations.</p>
+</div>
+"""
+
+@st.cache_resource
+def expected_format_markdown():
+    """Return the expected file format guidance"""
+    return """
+        **ePACT2 exports typically contain columns like:**
+        - Prescription Date / Month
+        - Drug Name / BNF Description  
+        - Net Ingredient Cost
+        - Items / Quantity
+        - BNF Code
+        - Practice Code
+        - CCG/ICB Code
+        
+        **Supported formats:** CSV, Excel (.xlsx)
+        **Max file size:** 200MB
+        """
+
+# Custom CSS
+st.markdown(page_css(), unsafe_allow_html=True)
+
+logger = logging.getLogger(__name__)
+
+# Errors a malformed column can raise during analysis; anything else propagates
+ANALYSIS_ERRORS = (ValueError, TypeError, KeyError, AttributeError, NotImplementedError)
+
+# Keywords that mark a column's role, precompiled so each name is scanned once per role in C
+COLUMN_ROLE_PATTERNS = {
+    'date': re.compile(r'date|month|period', re.IGNORECASE),
+    'cost': re.compile(r'cost|spend|amount|value', re.IGNORECASE),
+    'drug': re.compile(r'drug|product|item|medicine|bnf', re.IGNORECASE)
+}
+
+# Row count above which the duplicate check is skipped
+DUPLICATE_CHECK_MAX_ROWS = 500_000
+
+# A prescription row is identified by its BNF code, practice and date
+NATURAL_KEY_COLUMNS = ['BNF Code', 'Practice Code', 'Prescription Date']
+
+def detect_column_roles(columns):
+    """Classify columns as date/cost/drug candidates in a single pass over the names"""
+    roles = {role: [] for role in COLUMN_ROLE_PATTERNS}
+    for col in columns:
+        for role, pattern in COLUMN_ROLE_PATTERNS.items():
+            if pattern.search(col):
+                roles[role].append(col)
+    return roles['date'], roles['cost'], roles['drug']
+
+def parse_date_column(series):
+    """Parse a date column once, with a fixed format when the values are YYYYMM periods or ISO dates"""
+    if isinstance(series.dtype, pd.ArrowDtype) and series.dtype.kind == 'M':
+        # Arrow date32/timestamp columns from the pyarrow reader convert without parsing
+        return pd.to_datetime(series, errors='coerce')
+    if pd.api.types.is_datetime64_any_dtype(series):
+        return series
+    if pd.api.types.is_numeric_dtype(series):
+        series = series.astype('Int64').astype('string')
+    sample = series.dropna().astype(str).head(100)
+    if not sample.empty and sample.str.fullmatch(r'\d{6}').all():
+        # ePACT2 period columns such as 202301
+        return pd.to_datetime(series, format='%Y%m', errors='coerce', cache=True)
+    if not sample.empty and sample.str.fullmatch(r'\d{4}-\d{2}-\d{2}').all():
+        return pd.to_datetime(series, format='%Y-%m-%d', errors='coerce', cache=True)
+    # cache=True parses each distinct string once - monthly extracts repeat a few dozen dates
+    parsed = pd.to_datetime(series, format='ISO8601', errors='coerce', cache=True)
+    if parsed.isna().sum() > series.isna().sum():
+        # Not all ISO8601 - let pandas infer the format per value
+        parsed = pd.to_datetime(series, format='mixed', errors='coerce', cache=True)
+    return parsed
+
+if numba_available:
+    @njit(cache=True)
+    def _group_sum(codes, vals, n_groups):
+        """Sum vals into n_groups buckets by integer group code in one pass"""
+        out = np.zeros(n_groups)
+        for i in range(codes.size):
+            out[codes[i]] += vals[i]
+        return out
+else:
+    def _group_sum(codes, vals, n_groups):
+        """Sum vals into n_groups buckets by integer group code in one pass"""
+        return np.bincount(codes, weights=vals, minlength=n_groups)
+
+def monthly_cost_sums(costs, dates):
+    """Sum a cost column per calendar month of the parsed dates, indexed by period"""
+    codes, months = pd.factorize(dates.dt.to_period('M'), sort=True)
+    vals = np.nan_to_num(costs.to_numpy(dtype='float64', na_value=np.nan))
+    # NaT dates factorize to -1 and are left out, as groupby would
+    valid = codes >= 0
+    sums = _group_sum(codes[valid], vals[valid], len(months))
+    return pd.Series(sums, index=months, name=costs.name)
+
+def top_value_counts(series, k=10):
+    """Count values through categorical codes and return the k most frequent, largest first"""
+    cat = series.astype('category')
+    codes = cat.cat.codes.to_numpy()
+    counts = np.bincount(codes[codes >= 0], minlength=len(cat.cat.categories))
+    # argpartition finds the top k in O(n); only those k get sorted
+    idx = np.argpartition(-counts, k - 1)[:k] if len(counts) > k else np.arange(len(counts))
+    idx = idx[np.argsort(-counts[idx], kind='stable')]
+    return pd.Series(counts[idx], index=cat.cat.categories[idx], name='count').rename_axis(series.name)
+
+def count_duplicate_rows(df):
+    """Count duplicate rows, hashing only the natural key columns when the upload has them all"""
+    subset = NATURAL_KEY_COLUMNS if set(NATURAL_KEY_COLUMNS).issubset(df.columns) else None
+    return int(df.duplicated(subset=subset).sum())
+
+def summarize_epact_data(df):
+    """Return the cheap shape-only summary shown straight after upload"""
+    return {
         'row_count': len(df),
         'columns': list(df.columns),
+        'dtypes': {col: str(dtype) for col, dtype in df.dtypes.items()},
         'date_range': None,
         'top_drugs': None,
         'cost_summary': None,
         'data_quality': {}
     }
+
+def score_data_quality(analysis):
+    """Add the cell count and completeness percentage to an analysis's data_quality block"""
+    quality = analysis['data_quality']
+    quality['cells'] = analysis['row_count'] * len(analysis['columns'])
+    quality['quality_pct'] = 100 * (1 - quality['missing_values'] / quality['cells']) if quality['cells'] else 100.0
+
+def analyze_dates(df, col):
+    """Parse a date column and return its range alongside the parsed values"""
+    parsed = parse_date_column(df[col])
+    return {'start': parsed.min(), 'end': parsed.max(), 'column': col}, parsed
+
+def analyze_cost(df, col, table=None):
+    """Summarise a cost column, with one fused Arrow aggregation when the table has it as numbers"""
+    if table is not None and col in table.column_names and (
+        pa.types.is_integer(table[col].type) or pa.types.is_floating(table[col].type)
+    ):
+        totals = table.select([col]).group_by([]).aggregate([(col, 'sum'), (col, 'mean')]).to_pylist()[0]
+        total, average = totals[f'{col}_sum'], totals[f'{col}_mean']
+        return {'total': total or 0.0, 'average': average if average is not None else np.nan, 'column': col}
+    return {'total': df[col].sum(), 'average': df[col].mean(), 'column': col}
+
+def analyze_drugs(df, col, table=None):
+    """Count the most frequent values in a drug column, on the Arrow table when there is one"""
+    if table is not None and col in table.column_names:
+        return {'data': top_value_counts_arrow(table, col, 10), 'column': col}
+    return {'data': top_value_counts(df[col], 10), 'column': col}
+
+def top_value_counts_arrow(table, col, k=10):
+    """Count values with Arrow's hash kernel and return the k most frequent, largest first"""
+    counted = pc.value_counts(pc.drop_null(table[col]))
+    top = counted.take(pc.select_k_unstable(counted.field('counts'), k=k, sort_keys=[('counts', 'descending')]))
+    top = top.take(pc.array_sort_indices(top.field('counts'), order='descending'))
+    return pd.Series(
+        top.field('counts').to_numpy(),
+        index=pd.Index(top.field('values').to_pylist(), name=col),
+        name='count'
+    )
+
+def analyze_epact_data(df, table=None):
+    """Analyze uploaded ePACT2 data and return insights, reading null counts from its Arrow table if given"""
+    analysis = summarize_epact_data(df)
     
-    # Try to identify date columns
-    date_columns = [col for col in df.columns if any(word in col.lower() for word in ['date', 'month', 'period'])]
-    if date_columns:
-        try:
-            df[date_columns[0]] = pd.to_datetime(df[date_columns[0]], errors='coerce')
-            analysis['date_range'] = {
-                'start': df[date_columns[0]].min(),
-                'end': df[date_columns[0]].max(),
-                'column': date_columns[0]
-            }
-        except:
-            pass
+    date_columns, cost_columns, drug_columns = detect_column_roles(df.columns)
     
-    # Try to identify cost columns
-    cost_columns = [col for col in df.columns if any(word in col.lower() for word in ['cost', 'spend', 'amount', 'value'])]
-    if cost_columns:
-        try:
-            total_cost = df[cost_columns[0]].sum()
-            analysis['cost_summary'] = {
-                'total': total_cost,
-                'average': df[cost_columns[0]].mean(),
-                'column': cost_columns[0]
-            }
-        except:
-            pass
+    # The date, cost and drug probes each read a different column, so run them side by side
+    probes = {
+        'date_range': (analyze_dates, date_columns),
+        'cost_summary': (partial(analyze_cost, table=table), cost_columns),
+        'top_drugs': (partial(analyze_drugs, table=table), drug_columns)
+    }
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        futures = {key: executor.submit(probe, df, columns[0]) for key, (probe, columns) in probes.items() if columns}
+        for key, future in futures.items():
+            try:
+                analysis[key] = future.result()
+            except ANALYSIS_ERRORS as e:
+                logger.debug("Skipping %s: %s", key, e)
     
-    # Try to identify drug/product columns
-    drug_columns = [col for col in df.columns if any(word in col.lower() for word in ['drug', 'product', 'item', 'medicine', 'bnf'])]
-    if drug_columns:
-        try:
-            top_drugs = df[drug_columns[0]].value_counts().head(10)
-            analysis['top_drugs'] = {
-                'data': top_drugs,
-                'column': drug_columns[0]
-            }
-        except:
-            pass
+    if analysis['date_range']:
+        # Written back once the threads are done so later steps reuse the parsed column
+        analysis['date_range'], parsed_dates = analysis['date_range']
+        df[analysis['date_range']['column']] = parsed_dates
     
-    # Data quality checks
+    # Data quality checks - Arrow keeps each column's null count in its metadata, so a table
+    # needs no scan; otherwise count column by column so no full boolean frame is built.
+    # Hashing every row for duplicates is skipped on very large frames
+    if table is not None:
+        null_counts = [column.null_count for column in table.columns]
+    else:
+        null_counts = [int(df[col].isna().sum()) for col in df.columns]
     analysis['data_quality'] = {
-        'missing_values': df.isnull().sum().sum(),
-        'duplicate_rows': df.duplicated().sum(),
-        'empty_columns': (df.isnull().all()).sum()
+        'missing_values': sum(null_counts),
+        'duplicate_rows': count_duplicate_rows(df) if len(df) < DUPLICATE_CHECK_MAX_ROWS else None,
+        'empty_columns': sum(1 for count in null_counts if count == len(df))
     }
+    score_data_quality(analysis)
     
     return analysis
 
+# Uploads estimated above this many rows are analysed chunk by chunk
+LARGE_UPLOAD_ROWS = 100_000
+CSV_CHUNK_ROWS = 100_000
+
+def estimate_csv_rows(file_bytes):
+    """Estimate a CSV's row count from the line density of its first megabyte"""
+    sample = file_bytes[:1 << 20]
+    if not sample:
+        return 0
+    return int(len(file_bytes) * sample.count(b'\n') / len(sample))
+
+def analyze_epact_chunks(reader):
+    """Analyze a chunked CSV reader incrementally, returning the analysis and a preview"""
+    analysis = {
+        'row_count': 0,
+        'columns': [],
+        'date_range': None,
+        'top_drugs': None,
+        'cost_summary': None,
+        'data_quality': {}
+    }
+    preview = None
+    date_col = cost_col = drug_col = None
+    date_min = date_max = None
+    cost_total = 0.0
+    cost_count = 0
+    drug_counts = Counter()
+    monthly_costs = None
+    missing = None
+    
+    for chunk in reader:
+        if preview is None:
+            # Column roles are fixed by the header, so resolve them on the first chunk
+            preview = chunk.head(10)
+            analysis['columns'] = list(chunk.columns)
+            date_columns, cost_columns, drug_columns = detect_column_roles(chunk.columns)
+            date_col = date_columns[0] if date_columns else None
+            cost_col = cost_columns[0] if cost_columns else None
+            drug_col = drug_columns[0] if drug_columns else None
+        
+        analysis['row_count'] += len(chunk)
+        chunk_missing = chunk.isnull().sum()
+        missing = chunk_missing if missing is None else missing + chunk_missing
+        
+        dates = None
+        if date_col:
+            dates = parse_date_column(chunk[date_col])
+            chunk_min, chunk_max = dates.min(), dates.max()
+            if pd.notna(chunk_min):
+                date_min = chunk_min if date_min is None else min(date_min, chunk_min)
+                date_max = chunk_max if date_max is None else max(date_max, chunk_max)
+        
+        if cost_col:
+            try:
+                cost_total += chunk[cost_col].sum()
+                cost_count += chunk[cost_col].count()
+                if dates is not None:
+                    # Keep running monthly totals so the trend chart needs no second pass
+                    month_sums = monthly_cost_sums(chunk[cost_col], dates)
+                    monthly_costs = month_sums if monthly_costs is None else monthly_costs.add(month_sums, fill_value=0)
+            except ANALYSIS_ERRORS as e:
+                logger.debug("Skipping cost summary: %s", e)
+                cost_col = None
+        
+        if drug_col:
+            drug_counts.update(chunk[drug_col].value_counts().to_dict())
+    
+    if date_min is not None:
+        analysis['date_range'] = {'start': date_min, 'end': date_max, 'column': date_col}
+    
+    if cost_col and cost_count:
+        analysis['cost_summary'] = {
+            'total': cost_total,
+            'average': cost_total / cost_count,
+            'column': cost_col
+        }
+        if monthly_costs is not None:
+            analysis['monthly_costs'] = monthly_costs.sort_index()
+    
+    if drug_counts:
+        analysis['top_drugs'] = {
+            'data': pd.Series(dict(drug_counts.most_common(10)), name='count'),
+            'column': drug_col
+        }
+    
+    # Duplicates can't be found chunk by chunk without holding every row, so skip them
+    analysis['data_quality'] = {
+        'missing_values': int(missing.sum()) if missing is not None else 0,
+        'duplicate_rows': None,
+        'empty_columns': int((missing == analysis['row_count']).sum()) if missing is not None else 0
+    }
+    score_data_quality(analysis)
+    
+    return analysis, preview if preview is not None else pd.DataFrame()
+
+def downcast_numeric(df):
+    """Shrink integer columns to the narrowest int dtype that holds their values"""
+    # Floats stay float64 - float32 cost columns round pence in exports and drift in large totals
+    for col in df.select_dtypes(include='number').columns:
+        if pd.api.types.is_integer_dtype(df[col]):
+            df[col] = pd.to_numeric(df[col], downcast='integer')
+    return df
+
+def compact_string_columns(df):
+    """Store repeated string columns as categoricals and mostly-unique ones as Arrow strings"""
+    for col in df.select_dtypes(include=['object', 'string']).columns:
+        if df[col].nunique() < 0.5 * len(df):
+            df[col] = df[col].astype('category')
+        else:
+            df[col] = df[col].astype('string[pyarrow]')
+    return df
+
+def pick_analysis_columns(header):
+    """Pick the first date, cost and drug columns from a header - the only ones the analysis reads"""
+    picked = []
+    for candidates in detect_column_roles(header):
+        if candidates and candidates[0] not in picked:
+            picked.append(candidates[0])
+    return picked
+
+# Set NHS_FAST_IO=polars to parse uploaded CSVs with polars when it is installed
+FAST_IO = os.environ.get('NHS_FAST_IO', '')
+
+def read_csv_polars(file_bytes, usecols=None):
+    """Parse CSV bytes with polars' multithreaded reader into an ArrowDtype-backed frame"""
+    import polars as pl
+    return pl.read_csv(
+        io.BytesIO(file_bytes),
+        columns=usecols,
+        try_parse_dates=True,
+        infer_schema_length=10_000
+    ).to_pandas(use_pyarrow_extension_array=True)
+
+# Parquet copies of parsed uploads are pruned past this age (seconds) or total size (bytes)
+UPLOAD_CACHE_MAX_AGE = 24 * 60 * 60
+UPLOAD_CACHE_MAX_BYTES = 2 * 1024 * 1024 * 1024
+
+@st.cache_resource(show_spinner=False)
+def get_upload_cache_dir():
+    """Private directory, owned by this process, where parsed CSV uploads are kept as Parquet"""
+    # A reload or new session skips the CSV parse; the directory is removed when the process exits
+    path = tempfile.mkdtemp(prefix='nhsdatahub-uploads-')
+    atexit.register(shutil.rmtree, path, ignore_errors=True)
+    return path
+
+def upload_cache_path(file_hash, analysis_columns_only=False):
+    """Path of the Parquet copy of a parsed upload, separate for column-pruned reads"""
+    suffix = '-analysis' if analysis_columns_only else ''
+    return os.path.join(get_upload_cache_dir(), f"{file_hash}{suffix}.parquet")
+
+def prune_upload_cache(directory):
+    """Delete cached uploads past the age limit, then the oldest until the cache fits its size cap"""
+    cutoff = time.time() - UPLOAD_CACHE_MAX_AGE
+    files = []
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            try:
+                stat = entry.stat()
+                if stat.st_mtime < cutoff:
+                    os.remove(entry.path)
+                else:
+                    files.append((stat.st_mtime, stat.st_size, entry.path))
+            except OSError:
+                continue
+    
+    total = sum(size for _, size, _ in files)
+    for _, size, path in sorted(files):
+        if total <= UPLOAD_CACHE_MAX_BYTES:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        total -= size
+
+def write_upload_cache(table, path):
+    """Write a parsed upload to the Parquet cache, renaming into place so readers never see a partial file"""
+    try:
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        pq.write_table(table, tmp_path, compression='zstd', compression_level=3)
+        os.replace(tmp_path, path)
+        prune_upload_cache(os.path.dirname(path))
+    except OSError as e:
+        logger.debug("Could not cache upload as Parquet: %s", e)
+
+def arrow_types_mapper(arrow_type):
+    """Map Arrow types to ArrowDtype, leaving dictionary columns to become pandas categoricals"""
+    return None if pa.types.is_dictionary(arrow_type) else pd.ArrowDtype(arrow_type)
+
+def monthly_costs_arrow(table, date_col, cost_col):
+    """Sum a cost column by calendar month on an Arrow table, or None if the column types don't allow it"""
+    if date_col not in table.column_names or cost_col not in table.column_names:
+        return None
+    dates, costs = table[date_col], table[cost_col]
+    if not pa.types.is_temporal(dates.type) or not (pa.types.is_integer(costs.type) or pa.types.is_floating(costs.type)):
+        return None
+    months = pc.strftime(dates, format='%Y-%m')
+    monthly = (
+        pa.table({'month': months, cost_col: costs})
+        .filter(pc.is_valid(months))
+        .group_by('month')
+        .aggregate([(cost_col, 'sum')])
+        .sort_by('month')
+    )
+    return monthly.to_pandas().rename(columns={f'{cost_col}_sum': cost_col})[['month', cost_col]]
+
+def read_excel_values(file_bytes):
+    """Read the active sheet's cell values with openpyxl in read-only, values-only mode"""
+    from openpyxl import load_workbook
+    
+    wb = load_workbook(io.BytesIO(file_bytes), read_only=True, data_only=True)
+    try:
+        rows = wb.active.values
+        header = next(rows, None)
+        if header is None:
+            return pd.DataFrame()
+        columns = [str(name) if name is not None else f"Unnamed: {i}" for i, name in enumerate(header)]
+        return pd.DataFrame(list(rows), columns=columns)
+    finally:
+        wb.close()
+
+@st.cache_resource
+def get_parse_slots():
+    """Shared cap on upload parsing, so concurrent uploads from several sessions can't all parse at once"""
+    return threading.BoundedSemaphore(2)
+
+@st.cache_data(show_spinner=False, max_entries=4)
+def load_upload(file_hash, filename, _file_bytes, analysis_columns_only=False):
+    """Parse an uploaded file once per distinct upload, keyed on its content hash.
+    Returns (df, arrow_table, analysis): the Arrow table is only kept for CSVs read in one go,
+    and streamed files come back already analyzed; otherwise the analysis is None."""
+    # Parsed on the script thread, so parse_upload's cached helpers run with the session's context
+    with get_parse_slots():
+        return parse_upload(file_hash, filename, _file_bytes, analysis_columns_only)
+
+def parse_upload(file_hash, filename, file_bytes, analysis_columns_only=False):
+    """Read an uploaded CSV or Excel file into (df, arrow_table, analysis)"""
+    cache_path = upload_cache_path(file_hash, analysis_columns_only)
+    if filename.endswith('.csv') and os.path.exists(cache_path):
+        # Parsed before - the Parquet copy keeps the Arrow types, dictionary columns included
+        table = pq.read_table(cache_path)
+        df = table.to_pandas(types_mapper=arrow_types_mapper)
+        return compact_string_columns(downcast_numeric(df)), table, None
+    
+    usecols = None
+    if filename.endswith('.csv') and analysis_columns_only:
+        # Header-only probe, then parse just the columns the analysis needs
+        header = pd.read_csv(io.BytesIO(file_bytes), nrows=0).columns.tolist()
+        usecols = pick_analysis_columns(header) or None
+    
+    if filename.endswith('.csv') and estimate_csv_rows(file_bytes) > LARGE_UPLOAD_ROWS:
+        # Large export: aggregate batch by batch and keep only a preview in memory
+        try:
+            analysis, df = analyze_epact_chunks(iter_csv_arrow(file_bytes, usecols))
+        except pa.ArrowInvalid:
+            # Arrow fixes column types from the first block; fall back to pandas if a later one disagrees
+            reader = pd.read_csv(io.BytesIO(file_bytes), usecols=usecols, chunksize=CSV_CHUNK_ROWS, engine="c", low_memory=False)
+            analysis, df = analyze_epact_chunks(reader)
+        return df, None, analysis
+    
+    table = None
+    if filename.endswith('.csv'):
+        df = None
+        if FAST_IO == 'polars':
+            # Opt-in polars reader; it leaves no Arrow table, so analysis runs on the pandas frame
+            try:
+                df = read_csv_polars(file_bytes, usecols)
+            except Exception as e:
+                logger.warning("polars CSV read failed, using pyarrow: %s", e)
+        if df is None:
+            # Arrow's multithreaded parser is much faster; fall back to the C engine if it can't cope
+            try:
+                table = read_csv_arrow(file_bytes, usecols)
+                df = table.to_pandas(types_mapper=arrow_types_mapper)
+                write_upload_cache(table, cache_path)
+            except Exception:
+                df = pd.read_csv(io.BytesIO(file_bytes), usecols=usecols, engine="c", low_memory=False, cache_dates=True)
+    else:
+        # The Rust calamine reader is far faster than openpyxl; fall back if it isn't installed
+        try:
+            df = pd.read_excel(io.BytesIO(file_bytes), engine="calamine", dtype_backend="pyarrow")
+        except ImportError:
+            if filename.endswith('.xlsx'):
+                # Skips style/formula parsing that read_excel's default openpyxl path does
+                df = read_excel_values(file_bytes)
+            else:
+                df = pd.read_excel(io.BytesIO(file_bytes))
+    
+    df = compact_string_columns(downcast_numeric(df))
+    return df, table, None
+
+@st.cache_data(show_spinner=False, max_entries=4)
+def analyze_upload(file_hash, analysis_columns_only, _df, _table=None):
+    """Run the full analysis on a parsed upload, keyed on the same content hash as load_upload"""
+    return analyze_epact_data(_df, _table)
+
+@st.cache_data(show_spinner=False)
 def create_sample_data():
     """Create sample ePACT2 data for demonstration"""
-    import random
-    from datetime import datetime, timedelta
-    
     # Sample drug names
-    drugs = [
+    drugs = np.array([
         'Adalimumab', 'Infliximab', 'Metformin', 'Atorvastatin', 'Sertraline',
         'Omeprazole', 'Salbutamol', 'Prednisolone', 'Warfarin', 'Insulin'
-    ]
+    ])
     
-    # Generate sample data
-    data = []
-    start_date = datetime(2023, 1, 1)
+    # Generate each column as a single vectorised draw
+    n = 500
+    rng = np.random.default_rng(0)
+    dates = np.datetime64('2023-01-01') + rng.integers(0, 366, n).astype('timedelta64[D]')
+    # Fixed-width unicode casts size each string buffer exactly for its digit count
+    suffixes = np.array(['AA', 'BB', 'CC'])
+    bnf_codes = np.char.add(
+        np.char.add(rng.integers(1, 10, n).astype('U1'), rng.integers(10, 100, n).astype('U2')),
+        np.char.add(rng.integers(100, 1000, n).astype('U3'), suffixes[rng.integers(0, 3, n)])
+    )
     
-    for i in range(500):
-        date = start_date + timedelta(days=random.randint(0, 365))
-        drug = random.choice(drugs)
-        cost = random.uniform(10, 1000)
-        items = random.randint(1, 50)
-        
-        data.append({
-            'Prescription Date': date.strftime('%Y-%m-%d'),
-            'Drug Name': drug,
-            'Net Ingredient Cost': round(cost, 2),
-            'Items': items,
-            'BNF Code': f"{random.randint(1,9)}{random.randint(10,99)}{random.randint(100,999)}{random.choice(['AA', 'BB', 'CC'])}",
-            'Practice Code': f"P{random.randint(10000,99999)}",
-            'CCG Code': f"CCG{random.randint(100,999)}"
-        })
-    
-    return pd.DataFrame(data)
+    return pd.DataFrame({
+        'Prescription Date': np.datetime_as_string(dates, unit='D'),
+        'Drug Name': drugs[rng.integers(0, len(drugs), n)],
+        'Net Ingredient Cost': rng.uniform(10, 1000, n).round(2),
+        'Items': rng.integers(1, 51, n),
+        'BNF Code': bnf_codes,
+        'Practice Code': np.char.add('P', rng.integers(10000, 100000, n).astype('U5')),
+        'CCG Code': np.char.add('CCG', rng.integers(100, 1000, n).astype('U3'))
+    })
+
+# Chart builders - cached as resources keyed on the small aggregated values, so reruns
+# reuse the Figure instead of rebuilding it. Plotly is imported here so the page's first
+# paint, before any file is uploaded, doesn't pay for it
+@st.cache_resource
+def build_top_drugs_fig(drugs, counts):
+    """Build the top drugs horizontal bar chart"""
+    import plotly.express as px
+    fig = px.bar(
+        x=list(counts),
+        y=list(drugs),
+        orientation='h',
+        title="Top 10 Most Prescribed Drugs",
+        labels={'x': 'Number of Prescriptions', 'y': 'Drug'}
+    )
+    fig.update_layout(height=400, yaxis={'categoryorder': 'total ascending'})
+    return fig
+
+@st.cache_resource
+def build_monthly_trend_fig(months, costs, cost_col):
+    """Build the monthly spending line chart"""
+    import plotly.express as px
+    fig = px.line(
+        x=list(months),
+        y=list(costs),
+        title="Monthly Spending Trend",
+        labels={'y': 'Cost (£)', 'x': 'Month'}
+    )
+    fig.update_layout(height=400)
+    return fig
+
+@st.cache_resource
+def build_sample_pie_fig(drugs, counts):
+    """Build the sample data top drugs pie chart"""
+    import plotly.express as px
+    return px.pie(
+        values=list(counts),
+        names=list(drugs),
+        title="Sample Data - Top 5 Drugs by Prescription Count"
+    )
 
 # Main title
 st.title("📁 Upload & Process ePACT2 Data")
 st.subheader("Transform Your ePACT2 Exports with AI-Powered Analysis")
 
 # Information section
-st.markdown("""
-<div class="upload-zone">
-<h3>📋 What is ePACT2?</h3>
-<p><strong>ePACT2</strong> is the NHS Business Services Authority's prescription analysis tool that provides detailed prescription-level data for medicines optimization teams.</p>
-<p><strong>This tool helps you:</strong> Upload CSV exports from ePACT2 and get instant AI-powered insights, trend analysis, and actionable recommendations.</p>
-</div>
-""", unsafe_allow_html=True)
+st.markdown(epact_intro_html(), unsafe_allow_html=True)
 
 # Upload section
 st.header("📤 Upload Your ePACT2 Data")
@@ -174,30 +675,36 @@ with tab1:
     
     # File format guidance
     with st.expander("📋 Expected File Format"):
-        st.markdown("""
-        **ePACT2 exports typically contain columns like:**
-        - Prescription Date / Month
-        - Drug Name / BNF Description  
-        - Net Ingredient Cost
-        - Items / Quantity
-        - BNF Code
-        - Practice Code
-        - CCG/ICB Code
-        
-        **Supported formats:** CSV, Excel (.xlsx)
-        **Max file size:** 200MB
-        """)
+        st.markdown(expected_format_markdown())
+    
+    analysis_columns_only = st.checkbox(
+        "⚡ Load only the date, cost and drug columns",
+        help="Much faster for wide exports. The preview and exports will only include these columns."
+    )
     
     if uploaded_file is not None:
         try:
-            # Read the file
-            if uploaded_file.name.endswith('.csv'):
-                df = pd.read_csv(uploaded_file)
-            else:
-                df = pd.read_excel(uploaded_file)
+            # Read the file - cached on the content hash so reruns skip parsing
+            file_bytes = uploaded_file.getvalue()
+            file_hash = hashlib.blake2b(file_bytes, digest_size=16).hexdigest()
+            with st.spinner(f"Parsing {uploaded_file.name}..."):
+                df, table, analysis = load_upload(file_hash, uploaded_file.name, file_bytes, analysis_columns_only)
+            # Drop our reference to the raw upload now the parsed frame exists
+            del file_bytes
+            
+            # Streamed large files keep only preview rows - flagged so exports and Claude don't treat them as the upload
+            preview_only = analysis is not None and len(df) < analysis['row_count']
             
             # Store in session state for Claude
             st.session_state.uploaded_epact_data = df
+            st.session_state.uploaded_epact_preview_only = preview_only
+            if claude_available:
+                if preview_only:
+                    unregister_df('uploaded_epact_data')
+                else:
+                    register_df('uploaded_epact_data', df)
+            # Arrow table kept alongside so aggregations can use Arrow kernels without re-parsing
+            st.session_state.uploaded_epact_data_arrow = table
             st.session_state.upload_timestamp = datetime.now()
             
             st.markdown("""
@@ -208,128 +715,146 @@ with tab1:
             
             # Quick preview
             st.subheader("👀 Data Preview")
-            st.dataframe(df.head(10), use_container_width=True)
+            # Slice the Arrow table when there is one so only ten rows are converted for display
+            preview = table.slice(0, 10).to_pandas(types_mapper=arrow_types_mapper) if table is not None else df.head(10)
+            st.dataframe(preview, use_container_width=True)
             
-            # Basic analysis
-            analysis = analyze_epact_data(df)
+            # Streamed files are analysed while reading; otherwise the deep analysis waits for the button
+            run_deep = analysis is not None or st.session_state.get('deep_analysis_hash') == file_hash
+            if analysis is None:
+                analysis = analyze_upload(file_hash, analysis_columns_only, df, table) if run_deep else summarize_epact_data(df)
+            elif preview_only:
+                st.info(f"📦 Large file ({analysis['row_count']:,} rows) analysed in chunks - only the preview rows are kept in memory.")
             
             # Store analysis for Claude context
             st.session_state.epact_analysis = analysis
             
-            # Display analysis results
-            col1, col2, col3, col4 = st.columns(4)
-            
-            with col1:
-                st.metric("Total Records", f"{analysis['row_count']:,}")
-            
-            with col2:
-                st.metric("Columns", len(analysis['columns']))
-            
-            with col3:
-                if analysis['cost_summary']:
-                    st.metric("Total Cost", f"£{analysis['cost_summary']['total']:,.0f}")
-                else:
-                    st.metric("Total Cost", "N/A")
-            
-            with col4:
-                missing_pct = (analysis['data_quality']['missing_values'] / (len(df) * len(df.columns))) * 100
-                st.metric("Data Quality", f"{100-missing_pct:.1f}%")
-            
-            # Detailed analysis
-            st.subheader("📊 Automatic Data Analysis")
-            
-            col1, col2 = st.columns([2, 1])
-            
-            with col1:
-                if analysis['top_drugs'] and analysis['top_drugs']['data'] is not None:
-                    # Top drugs chart
-                    top_drugs_df = analysis['top_drugs']['data'].head(10).reset_index()
-                    top_drugs_df.columns = ['Drug', 'Count']
-                    
-                    fig = px.bar(
-                        top_drugs_df,
-                        x='Count',
-                        y='Drug',
-                        orientation='h',
-                        title="Top 10 Most Prescribed Drugs",
-                        labels={'Count': 'Number of Prescriptions'}
-                    )
-                    fig.update_layout(height=400)
-                    st.plotly_chart(fig, use_container_width=True)
-                else:
-                    st.info("Could not identify drug columns for analysis. Please check your data format.")
-            
-            with col2:
-                # Data quality summary
-                st.markdown("""
-                <div class="analysis-card">
-                <h4>🔍 Data Quality Report</h4>
-                """, unsafe_allow_html=True)
+            if not run_deep:
+                # Quick summary only - shape and types come straight from the parsed frame
+                col1, col2 = st.columns(2)
                 
-                quality = analysis['data_quality']
+                with col1:
+                    st.metric("Total Records", f"{analysis['row_count']:,}")
                 
-                if quality['missing_values'] == 0:
-                    st.success("✅ No missing values")
-                else:
-                    st.warning(f"⚠️ {quality['missing_values']} missing values")
+                with col2:
+                    st.metric("Columns", len(analysis['columns']))
                 
-                if quality['duplicate_rows'] == 0:
-                    st.success("✅ No duplicate rows")
-                else:
-                    st.warning(f"⚠️ {quality['duplicate_rows']} duplicate rows")
+                if st.button("🔍 Run deep analysis", type="primary"):
+                    st.session_state.deep_analysis_hash = file_hash
+                    st.rerun()
+            else:
+                # Display analysis results
+                col1, col2, col3, col4 = st.columns(4)
                 
-                if quality['empty_columns'] == 0:
-                    st.success("✅ All columns contain data")
-                else:
-                    st.warning(f"⚠️ {quality['empty_columns']} empty columns")
+                with col1:
+                    st.metric("Total Records", f"{analysis['row_count']:,}")
                 
-                st.markdown("</div>", unsafe_allow_html=True)
-            
-            # Date range analysis
-            if analysis['date_range']:
-                st.subheader("📅 Time Period Analysis")
-                date_info = analysis['date_range']
+                with col2:
+                    st.metric("Columns", len(analysis['columns']))
+                
+                with col3:
+                    if analysis['cost_summary']:
+                        st.metric("Total Cost", f"£{analysis['cost_summary']['total']:,.0f}")
+                    else:
+                        st.metric("Total Cost", "N/A")
                 
-                col1, col2, col3 = st.columns(3)
+                with col4:
+                    st.metric("Data Quality", f"{analysis['data_quality']['quality_pct']:.1f}%")
+                
+                # Detailed analysis
+                st.subheader("📊 Automatic Data Analysis")
+                
+                col1, col2 = st.columns([2, 1])
                 
                 with col1:
-                    st.metric("Start Date", date_info['start'].strftime('%Y-%m-%d'))
+                    if analysis['top_drugs'] and analysis['top_drugs']['data'] is not None:
+                        # Top drugs chart, plotted straight from the counts series
+                        top_drugs = analysis['top_drugs']['data'].head(10)
+                        fig = build_top_drugs_fig(tuple(top_drugs.index.astype(str)), tuple(top_drugs.tolist()))
+                        st.plotly_chart(fig, use_container_width=True, theme=None)
+                    else:
+                        st.info("Could not identify drug columns for analysis. Please check your data format.")
                 
                 with col2:
-                    st.metric("End Date", date_info['end'].strftime('%Y-%m-%d'))
+                    # Data quality summary
+                    st.markdown("""
+                    <div class="analysis-card">
+                    <h4>🔍 Data Quality Report</h4>
+                    """, unsafe_allow_html=True)
+                    
+                    quality = analysis['data_quality']
+                    
+                    if quality['missing_values'] == 0:
+                        st.success("✅ No missing values")
+                    else:
+                        st.warning(f"⚠️ {quality['missing_values']} missing values")
+                    
+                    if quality['duplicate_rows'] is None:
+                        st.info("ℹ️ Duplicate check skipped (large file)")
+                    elif quality['duplicate_rows'] == 0:
+                        st.success("✅ No duplicate rows")
+                    else:
+                        st.warning(f"⚠️ {quality['duplicate_rows']} duplicate rows")
+                    
+                    if quality['empty_columns'] == 0:
+                        st.success("✅ All columns contain data")
+                    else:
+                        st.warning(f"⚠️ {quality['empty_columns']} empty columns")
+                    
+                    st.markdown("</div>", unsafe_allow_html=True)
                 
-                with col3:
-                    duration = (date_info['end'] - date_info['start']).days
-                    st.metric("Duration", f"{duration} days")
-            
-            # Cost analysis if available
-            if analysis['cost_summary']:
-                st.subheader("💰 Cost Analysis")
+                # Date range analysis
+                if analysis['date_range']:
+                    st.subheader("📅 Time Period Analysis")
+                    date_info = analysis['date_range']
+                    
+                    col1, col2, col3 = st.columns(3)
+                    
+                    with col1:
+                        st.metric("Start Date", date_info['start'].strftime('%Y-%m-%d'))
+                    
+                    with col2:
+                        st.metric("End Date", date_info['end'].strftime('%Y-%m-%d'))
+                    
+                    with col3:
+                        duration = (date_info['end'] - date_info['start']).days
+                        st.metric("Duration", f"{duration} days")
                 
-                cost_col = analysis['cost_summary']['column']
+                # Cost analysis if available
+                if analysis['cost_summary']:
+                    st.subheader("💰 Cost Analysis")
+                    
+                    cost_col = analysis['cost_summary']['column']
+                    
+                    # Monthly trend if date data available
+                    if analysis['date_range']:
+                        try:
+                            date_col = analysis['date_range']['column']
+                            monthly_costs = None
+                            if 'monthly_costs' in analysis:
+                                # Streamed uploads carry their monthly totals in the analysis
+                                monthly_costs = analysis['monthly_costs'].rename_axis('month').reset_index(name=cost_col)
+                            elif table is not None:
+                                # Roll up on the Arrow table with its group_by kernel when the types allow
+                                monthly_costs = monthly_costs_arrow(table, date_col, cost_col)
+                            if monthly_costs is None:
+                                # Group the cost column by month directly rather than copying the whole frame.
+                                # This rerun's df is a fresh copy from the cache, so parse again - it returns
+                                # straight away for columns that are already datetime64
+                                dates = parse_date_column(df[date_col])
+                                monthly_costs = monthly_cost_sums(df[cost_col], dates).rename_axis('month').reset_index(name=cost_col)
+                            monthly_costs['month'] = monthly_costs['month'].astype(str)
+                            
+                            fig_trend = build_monthly_trend_fig(
+                                tuple(monthly_costs['month']),
+                                tuple(monthly_costs[cost_col].tolist()),
+                                cost_col
+                            )
+                            st.plotly_chart(fig_trend, use_container_width=True, theme=None)
+                            
+                        except Exception as e:
+                            st.warning(f"Could not create trend analysis: {str(e)}")
                 
-                # Monthly trend if date data available
-                if analysis['date_range']:
-                    try:
-                        df_copy = df.copy()
-                        df_copy[analysis['date_range']['column']] = pd.to_datetime(df_copy[analysis['date_range']['column']])
-                        df_copy['month'] = df_copy[analysis['date_range']['column']].dt.to_period('M')
-                        monthly_costs = df_copy.groupby('month')[cost_col].sum().reset_index()
-                        monthly_costs['month'] = monthly_costs['month'].astype(str)
-                        
-                        fig_trend = px.line(
-                            monthly_costs,
-                            x='month',
-                            y=cost_col,
-                            title="Monthly Spending Trend",
-                            labels={cost_col: 'Cost (£)', 'month': 'Month'}
-                        )
-                        fig_trend.update_layout(height=400)
-                        st.plotly_chart(fig_trend, use_container_width=True)
-                        
-                    except Exception as e:
-                        st.warning(f"Could not create trend analysis: {str(e)}")
-            
             # Action buttons
             st.subheader("🚀 Next Steps")
             
@@ -361,6 +886,9 @@ with tab2:
         
         # Store sample data with persistence flag
         st.session_state.uploaded_epact_data = sample_df
+        st.session_state.uploaded_epact_preview_only = False
+        if claude_available:
+            register_df('uploaded_epact_data', sample_df)
         st.session_state.upload_timestamp = datetime.now()
         st.session_state.is_sample_data = True
         st.session_state.data_loaded = True  # Flag to persist data
@@ -386,7 +914,7 @@ TOP PRESCRIBED DRUGS:
 DATA QUALITY:
 - Missing Values: {analysis['data_quality']['missing_values']}
 - Duplicate Rows: {analysis['data_quality']['duplicate_rows']}
-- Data Completeness: {100 - (analysis['data_quality']['missing_values'] / (len(sample_df) * len(sample_df.columns))) * 100:.1f}%
+- Data Completeness: {analysis['data_quality']['quality_pct']:.1f}%
 
 This is sample demonstration data showing typical ePACT2 prescription patterns.
 """
@@ -417,16 +945,10 @@ This is sample demonstration data showing typical ePACT2 prescription patterns.
         
         # Sample data insights
         if analysis['top_drugs'] and analysis['top_drugs']['data'] is not None:
-            top_drugs_df = analysis['top_drugs']['data'].head(5).reset_index()
-            top_drugs_df.columns = ['Drug', 'Prescriptions']
+            top_drugs = analysis['top_drugs']['data'].head(5)
             
-            fig = px.pie(
-                top_drugs_df,
-                values='Prescriptions',
-                names='Drug',
-                title="Sample Data - Top 5 Drugs by Prescription Count"
-            )
-            st.plotly_chart(fig, use_container_width=True)
+            fig = build_sample_pie_fig(tuple(top_drugs.index.astype(str)), tuple(top_drugs.tolist()))
+            st.plotly_chart(fig, use_container_width=True, theme=None)
         
         # Action buttons for sample data
         st.subheader("🚀 Next Steps with Sample Data")
@@ -1,12 +1,24 @@
+import os
 import streamlit as st
+
+st.set_page_config(page_title="Export Results", page_icon="💾", layout="wide")
+
+# Deployments can switch exports off; checked before the heavy imports below are loaded
+if os.environ.get("EXPORTS_ENABLED", "1") == "0":
+    st.info("💾 Exports are not enabled on this deployment.")
+    st.stop()
+
 import pandas as pd
-import plotly.express as px
-import plotly.graph_objects as go
-from plotly.subplots import make_subplots
+import numpy as np
+import pyarrow as pa
 import io
-import base64
+import importlib.util
+import gzip
+import zipfile
+import hashlib
 from datetime import datetime
-import json
+import orjson
+from utils.data_helpers import frame_digest
 
 # Import Claude integration
 try:
@@ -15,8 +27,6 @@ try:
 except ImportError:
     claude_available = False
 
-st.set_page_config(page_title="Export Results", page_icon="💾", layout="wide")
-
 # Set current page for Claude context
 st.session_state.current_page = "Export Results - Data Export & Reporting"
 
@@ -55,14 +65,113 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
-def create_excel_export(data, analysis=None):
-    """Create an Excel file with multiple sheets"""
+# Rows converted to cell values per block when streaming the Excel export
+EXCEL_CHUNK_ROWS = 10_000
+
+# Below this many rows Excel exports use xlsxwriter, when it is installed
+EXCEL_XLSXWRITER_MAX_ROWS = 10_000
+
+# CSV/Excel exports above this many rows are split into zipped CSV parts
+EXPORT_SEGMENT_ROWS = 250_000
+
+# Columns shown in the export data preview
+PREVIEW_MAX_COLUMNS = 30
+
+def export_fingerprint(data):
+    """Exact content key for the frame being exported, hashed once per frame object in a session"""
+    # The export builders' caches are shared by every session, so an approximate key could serve
+    # one upload's file for another; the frame is kept with its digest so the identity check is safe
+    memo = st.session_state.get('export_fingerprint')
+    if memo is not None and memo[0] is data:
+        return memo[1]
+    digest = frame_digest(data)
+    st.session_state.export_fingerprint = (data, digest)
+    return digest
+
+def analysis_digest(analysis):
+    """Content key for an analysis dict, so exports that embed it rebuild when it changes"""
+    if not analysis:
+        return None
+    # Series such as monthly_costs are keyed on their full JSON rather than their truncated repr
+    analysis_bytes = orjson.dumps(
+        analysis,
+        default=lambda value: value.to_json(date_format='iso') if isinstance(value, (pd.Series, pd.DataFrame)) else str(value),
+        option=orjson.OPT_SORT_KEYS | orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+    )
+    return hashlib.blake2b(analysis_bytes, digest_size=16).hexdigest()
+
+@st.cache_data(show_spinner=False, max_entries=4)
+def build_preview_table(fingerprint, _data):
+    """Convert the first ten rows to an Arrow table once, so reruns hand Streamlit Arrow data directly"""
+    preview = _data.head(10).iloc[:, :PREVIEW_MAX_COLUMNS]
+    try:
+        return pa.Table.from_pandas(preview, preserve_index=False)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        # Mixed-type object columns can't be typed up front; let Streamlit convert them itself
+        return preview
+
+@st.cache_data(show_spinner=False, max_entries=4)
+def optimize_for_export(fingerprint, _data):
+    """Narrow integer columns and store repeated strings as categoricals before serializing"""
+    data = _data.copy(deep=False)
+    for col in data.select_dtypes(include='integer').columns:
+        data[col] = pd.to_numeric(data[col], downcast='integer')
+    # Floats stay float64 - float32 would write values like 12.340000152587891 to Excel and JSON
+    for col in data.select_dtypes(include=['object', 'string']).columns:
+        # One hash pass gives both the cardinality and the codes to rebuild the column from
+        codes, uniques = pd.factorize(data[col])
+        if len(uniques) < 0.5 * max(len(data), 1):
+            data[col] = pd.Categorical.from_codes(codes, uniques)
+        elif data[col].dtype == object:
+            # Too many distinct values for a category; still point repeats at one shared string object
+            values = np.asarray(uniques, dtype=object)[codes]
+            data[col] = pd.Series(np.where(codes >= 0, values, data[col].to_numpy()), index=data.index, dtype=object)
+    return data
+
+def excel_column_widths(data):
+    """Estimate Excel column widths from the first and last rows; numbers and dates get a fixed width"""
+    sample = pd.concat([data.head(500), data.tail(500)]) if len(data) > 1000 else data
+    widths = []
+    for col in data.columns:
+        if pd.api.types.is_numeric_dtype(sample[col]) or pd.api.types.is_datetime64_any_dtype(sample[col]):
+            max_length = max(len(str(col)), 12)
+        else:
+            sample_length = sample[col].astype(str).str.len().max() if len(sample) else 0
+            max_length = max(int(sample_length) if pd.notna(sample_length) else 0, len(str(col)))
+        widths.append(min(max_length + 2, 50))
+    return widths
+
+def excel_summary_rows(analysis, exported_at):
+    """Build the Metric/Value rows of the Excel summary sheet"""
+    summary_data = []
+    summary_data.append(['Analysis Date', exported_at.strftime('%Y-%m-%d %H:%M')])
+    summary_data.append(['Total Records', analysis.get('row_count', 'N/A')])
+    summary_data.append(['Columns', len(analysis.get('columns', []))])
+    
+    if analysis.get('cost_summary'):
+        summary_data.append(['Total Cost', f"£{analysis['cost_summary']['total']:,.2f}"])
+        summary_data.append(['Average Cost', f"£{analysis['cost_summary']['average']:,.2f}"])
+    
+    if analysis.get('date_range'):
+        summary_data.append(['Date Range Start', analysis['date_range']['start']])
+        summary_data.append(['Date Range End', analysis['date_range']['end']])
+    
+    return summary_data
+
+def excel_engine(data):
+    """Pick the Excel writer - xlsxwriter is quickest on small frames, openpyxl write-only scales flat"""
+    if len(data) < EXCEL_XLSXWRITER_MAX_ROWS and importlib.util.find_spec('xlsxwriter') is not None:
+        return 'xlsxwriter'
+    return 'openpyxl'
+
+def create_excel_xlsxwriter(data, analysis, exported_at):
+    """Create an Excel file with multiple sheets through pandas' xlsxwriter engine"""
     output = io.BytesIO()
     
-    with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
+    # default_date_format lets the summary's date range values keep a date format under write_column
+    with pd.ExcelWriter(output, engine='xlsxwriter',
+                        engine_kwargs={'options': {'default_date_format': 'yyyy-mm-dd hh:mm:ss'}}) as writer:
         workbook = writer.book
-        
-        # Define formats
         header_format = workbook.add_format({
             'bold': True,
             'text_wrap': True,
@@ -71,115 +180,266 @@ def create_excel_export(data, analysis=None):
             'border': 1
         })
         
-        currency_format = workbook.add_format({'num_format': '£#,##0.00'})
-        date_format = workbook.add_format({'num_format': 'dd/mm/yyyy'})
-        
         # Main data sheet
         data.to_excel(writer, sheet_name='Raw Data', index=False)
         worksheet = writer.sheets['Raw Data']
-        
-        # Format headers
         for col_num, value in enumerate(data.columns.values):
-            worksheet.write(0, col_num, value, header_format)
-        
-        # Auto-adjust column widths
-        for i, col in enumerate(data.columns):
-            max_length = max(data[col].astype(str).map(len).max(), len(col))
-            worksheet.set_column(i, i, min(max_length + 2, 50))
+            worksheet.write(0, col_num, str(value), header_format)
+        for i, width in enumerate(excel_column_widths(data)):
+            worksheet.set_column(i, i, width)
         
-        # Summary sheet if analysis available
+        # Summary sheet if analysis available - a handful of rows, written directly rather than via to_excel
         if analysis:
-            summary_data = []
-            summary_data.append(['Analysis Date', datetime.now().strftime('%Y-%m-%d %H:%M')])
-            summary_data.append(['Total Records', analysis.get('row_count', 'N/A')])
-            summary_data.append(['Columns', len(analysis.get('columns', []))])
-            
-            if analysis.get('cost_summary'):
-                summary_data.append(['Total Cost', f"£{analysis['cost_summary']['total']:,.2f}"])
-                summary_data.append(['Average Cost', f"£{analysis['cost_summary']['average']:,.2f}"])
-            
-            if analysis.get('date_range'):
-                summary_data.append(['Date Range Start', analysis['date_range']['start']])
-                summary_data.append(['Date Range End', analysis['date_range']['end']])
-            
-            summary_df = pd.DataFrame(summary_data, columns=['Metric', 'Value'])
-            summary_df.to_excel(writer, sheet_name='Summary', index=False)
-            
-            # Format summary sheet
-            summary_worksheet = writer.sheets['Summary']
-            for col_num, value in enumerate(summary_df.columns.values):
-                summary_worksheet.write(0, col_num, value, header_format)
-            
+            summary_worksheet = workbook.add_worksheet('Summary')
+            summary_worksheet.write_row(0, 0, ['Metric', 'Value'], header_format)
+            metrics, values = zip(*excel_summary_rows(analysis, exported_at))
+            summary_worksheet.write_column(1, 0, metrics)
+            summary_worksheet.write_column(1, 1, values)
             summary_worksheet.set_column(0, 0, 20)
             summary_worksheet.set_column(1, 1, 30)
     
-    output.seek(0)
-    return output
-
-def create_csv_export(data):
-    """Create CSV export"""
-    output = io.StringIO()
-    data.to_csv(output, index=False)
     return output.getvalue()
 
-def create_json_export(data, analysis=None):
-    """Create JSON export with metadata"""
-    export_data = {
-        'metadata': {
-            'export_date': datetime.now().isoformat(),
-            'record_count': len(data),
-            'columns': list(data.columns)
-        },
-        'data': data.to_dict('records')
-    }
+def create_excel_openpyxl(data, analysis, exported_at):
+    """Create an Excel file with multiple sheets, streamed through a write-only openpyxl workbook"""
+    from openpyxl import Workbook
+    from openpyxl.cell import WriteOnlyCell
+    from openpyxl.styles import Alignment, Border, Font, PatternFill, Side
+    from openpyxl.utils import get_column_letter
     
+    output = io.BytesIO()
+    workbook = Workbook(write_only=True)
+    
+    # Header style objects are built once and shared by every header cell
+    header_font = Font(bold=True)
+    header_fill = PatternFill(fill_type='solid', fgColor='D7E4BC')
+    header_alignment = Alignment(wrap_text=True, vertical='top')
+    thin = Side(style='thin')
+    header_border = Border(left=thin, right=thin, top=thin, bottom=thin)
+    
+    def header_row(worksheet, names):
+        cells = []
+        for name in names:
+            cell = WriteOnlyCell(worksheet, value=str(name))
+            cell.font = header_font
+            cell.fill = header_fill
+            cell.alignment = header_alignment
+            cell.border = header_border
+            cells.append(cell)
+        return cells
+    
+    # Main data sheet - widths must be set before the first row is written
+    worksheet = workbook.create_sheet('Raw Data')
+    for i, width in enumerate(excel_column_widths(data), start=1):
+        worksheet.column_dimensions[get_column_letter(i)].width = width
+    
+    worksheet.append(header_row(worksheet, data.columns))
+    for start in range(0, len(data), EXCEL_CHUNK_ROWS):
+        block = data.iloc[start:start + EXCEL_CHUNK_ROWS]
+        missing = block.isna()
+        if missing.to_numpy().any():
+            # Missing values become empty cells; openpyxl can't write NaN/NA/NaT
+            block = block.astype(object).where(~missing, None)
+        # itertuples yields plain tuples in one traversal, rather than a Series per row as iloc[i] would
+        for row in block.itertuples(index=False, name=None):
+            worksheet.append(row)
+    
+    # Summary sheet if analysis available
     if analysis:
-        export_data['analysis'] = analysis
-    
-    return json.dumps(export_data, indent=2, default=str)
+        summary_worksheet = workbook.create_sheet('Summary')
+        summary_worksheet.column_dimensions['A'].width = 20
+        summary_worksheet.column_dimensions['B'].width = 30
+        summary_worksheet.append(header_row(summary_worksheet, ['Metric', 'Value']))
+        for row in excel_summary_rows(analysis, exported_at):
+            summary_worksheet.append(row)
+    
+    workbook.save(output)
+    return output.getvalue()
 
-def generate_summary_report():
-    """Generate a text summary report"""
-    report = f"""
-NHS Prescribing Data Analysis Report
-Generated: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}
+@st.cache_data(show_spinner=False, max_entries=4)
+def create_excel_export(fingerprint, _data, _analysis, exported_at):
+    """Create an Excel file with the engine suited to the data's size.
+    exported_at is part of the cache key - callers pass it to the minute the summary sheet shows."""
+    if excel_engine(_data) == 'xlsxwriter':
+        return create_excel_xlsxwriter(_data, _analysis, exported_at)
+    return create_excel_openpyxl(_data, _analysis, exported_at)
+
+def is_plain_numeric(data):
+    """True when every column is a NumPy int or float64 with no missing values - the fast CSV path's domain"""
+    # float32 is left to pandas, which writes its shorter single-precision form
+    return (
+        len(data) > 0
+        and all(isinstance(dtype, np.dtype) and (dtype.kind in 'iu' or dtype == np.float64) for dtype in data.dtypes)
+        and not data.isna().to_numpy().any()
+    )
 
-=== EXECUTIVE SUMMARY ===
+def fast_numeric_csv(data):
+    """Format a plain numeric frame as CSV text with one %-format per row, skipping pandas' per-column dispatch"""
+    header = data.head(0).to_csv(index=False, lineterminator='\n')
+    # repr matches the shortest round-trip form pandas writes for floats
+    fmt = ','.join(['%r'] * len(data.columns))
+    rows = zip(*(data[col].tolist() for col in data.columns))
+    return header + '\n'.join(fmt % row for row in rows) + '\n'
+
+@st.cache_data(show_spinner=False, max_entries=4)
+def create_csv_export(fingerprint, _data, compress=False):
+    """Create CSV export as UTF-8 bytes, optionally gzipped"""
+    data = _data
+    if is_plain_numeric(data):
+        text = fast_numeric_csv(data).encode('utf-8')
+        return gzip.compress(text, compresslevel=1) if compress else text
+    
+    # Writing bytes directly skips holding a str copy of the whole file alongside the encoded one
+    output = io.BytesIO()
+    compression = {'method': 'gzip', 'compresslevel': 1} if compress else None
+    data.to_csv(output, index=False, chunksize=50_000, encoding='utf-8', compression=compression)
+    return output.getvalue()
 
-"""
+@st.cache_data(show_spinner=False, max_entries=4)
+def create_segmented_csv_zip(fingerprint, _data, dataset_name, segment_size=EXPORT_SEGMENT_ROWS):
+    """Create a zip of CSV parts of at most segment_size rows each"""
+    data = _data
+    output = io.BytesIO()
+    with zipfile.ZipFile(output, 'w', zipfile.ZIP_DEFLATED, compresslevel=1) as zf:
+        for part, start in enumerate(range(0, len(data), segment_size), start=1):
+            # Each part goes through to_csv on its own, so only one segment's text is held at a time
+            chunk = data.iloc[start:start + segment_size]
+            zf.writestr(f"{dataset_name}_part{part:03d}.csv", chunk.to_csv(index=False))
+    return output.getvalue()
+
+@st.cache_data(show_spinner=False, max_entries=4)
+def create_parquet_export(fingerprint, _data):
+    """Create a zstd-compressed Parquet export"""
+    data = _data
+    # Parquet dictionary-encodes each column by default, so repeated BNF/practice codes stay small
+    output = io.BytesIO()
+    data.to_parquet(output, engine='pyarrow', compression='zstd', index=False)
+    return output.getvalue()
+
+def json_export_metadata(data, exported_at):
+    """Build the metadata block of the JSON export"""
+    return {
+        'export_date': exported_at.isoformat(),
+        'record_count': len(data),
+        'columns': list(data.columns)
+    }
+
+def json_export_records(data, pretty=False):
+    """Build the JSON export's records - dicts for the pretty layout, pandas-written bytes for compact"""
+    if pretty:
+        return data.to_dict('records')
+    return data.to_json(orient='records', date_format='iso').encode('utf-8')
+
+def json_export_schema(data):
+    """Describe each column's name and dtype for the columnar JSON layout"""
+    return [{'name': str(col), 'dtype': str(dtype)} for col, dtype in data.dtypes.items()]
+
+def json_export_columns(data):
+    """Build the columnar JSON body - one array per column, each written by pandas' C writer"""
+    parts = [
+        orjson.dumps(str(col)) + b':' + data[col].to_json(orient='values', date_format='iso').encode('utf-8')
+        for col in data.columns
+    ]
+    return b'{' + b','.join(parts) + b'}'
+
+@st.cache_data(show_spinner=False, max_entries=4)
+def create_json_export_body(fingerprint, _data, _analysis, pretty, columnar):
+    """Build everything in the JSON export after its metadata block, which carries the export time"""
+    data, analysis = _data, _analysis
+    options = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+    
+    if columnar:
+        # Column names are written once rather than repeated in every record
+        parts = [
+            b',"schema":', orjson.dumps(json_export_schema(data)),
+            b',"columns":', json_export_columns(data)
+        ]
+        if analysis:
+            parts += [b',"analysis":', orjson.dumps(analysis, default=str, option=options)]
+        parts.append(b'}')
+        return b''.join(parts)
+    
+    records = json_export_records(data, pretty)
+    if pretty:
+        export_data = {'data': records}
+        if analysis:
+            export_data['analysis'] = analysis
+        # Drop the opening brace; the metadata key is written in front of the remaining members
+        return b',\n' + orjson.dumps(export_data, default=str, option=options | orjson.OPT_INDENT_2)[2:]
     
-    # Check what data is available
+    # Compact output is stitched together so the records go through pandas' C writer, not per-row dicts
+    parts = [b',"data":', records]
+    if analysis:
+        parts += [b',"analysis":', orjson.dumps(analysis, default=str, option=options)]
+    parts.append(b'}')
+    return b''.join(parts)
+
+def create_json_export(fingerprint, data, analysis, pretty, columnar, exported_at):
+    """Create JSON export with metadata, returned with the metadata block so previews can reuse it"""
+    # The metadata is stamped outside the cached body so the export date is always current
+    metadata = json_export_metadata(data, exported_at)
+    options = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+    body = create_json_export_body(fingerprint, data, analysis, pretty, columnar)
+    
+    if pretty and not columnar:
+        # Nest the indented metadata one level in, matching the body orjson indented as a whole
+        metadata_bytes = orjson.dumps(metadata, default=str, option=options | orjson.OPT_INDENT_2)
+        return b'{\n  "metadata": ' + metadata_bytes.replace(b'\n', b'\n  ') + body, metadata
+    return b'{"metadata":' + orjson.dumps(metadata, default=str, option=options) + body, metadata
+
+def summary_report_inputs():
+    """Pull the values the summary report needs out of session state as hashable arguments"""
     if hasattr(st.session_state, 'uploaded_epact_data'):
-        data = st.session_state.uploaded_epact_data
         analysis = getattr(st.session_state, 'epact_analysis', {})
+        cost = analysis.get('cost_summary')
+        date_range = analysis.get('date_range')
+        top_drugs = analysis.get('top_drugs')
+        return {
+            # The analysis counts every row, including those of a large file that was only streamed
+            'record_count': analysis.get('row_count', len(st.session_state.uploaded_epact_data)),
+            'cost': (cost['total'], cost['average']) if cost else None,
+            'period': (str(date_range['start']), str(date_range['end'])) if date_range else None,
+            'top_drugs': tuple(top_drugs['data'].head(5).items()) if top_drugs else None
+        }
+    if hasattr(st.session_state, 'current_drug'):
+        return {
+            'drug_name': st.session_state.current_drug,
+            'drug_context': getattr(st.session_state, 'comprehensive_context', None)
+        }
+    return {}
+
+@st.cache_data(show_spinner=False, max_entries=8)
+def build_summary_report_body(record_count=None, cost=None, period=None, top_drugs=None,
+                              drug_name=None, drug_context=None):
+    """Format the report body; cached, since reruns usually ask for the same report again"""
+    report = ""
+    
+    if record_count is not None:
+        report += f"Dataset: ePACT2 Upload ({record_count:,} records)\n"
         
-        report += f"Dataset: ePACT2 Upload ({len(data):,} records)\n"
-        
-        if analysis.get('cost_summary'):
-            cost = analysis['cost_summary']
-            report += f"Total Cost: £{cost['total']:,.2f}\n"
-            report += f"Average Cost: £{cost['average']:,.2f}\n"
+        if cost:
+            report += f"Total Cost: £{cost[0]:,.2f}\n"
+            report += f"Average Cost: £{cost[1]:,.2f}\n"
         
-        if analysis.get('date_range'):
-            date_range = analysis['date_range']
-            report += f"Period: {date_range['start']} to {date_range['end']}\n"
+        if period:
+            report += f"Period: {period[0]} to {period[1]}\n"
         
-        if analysis.get('top_drugs'):
+        if top_drugs:
             report += "\n=== TOP PRESCRIBED DRUGS ===\n"
-            for drug, count in analysis['top_drugs']['data'].head(5).items():
+            for drug, count in top_drugs:
                 report += f"- {drug}: {count:,} prescriptions\n"
     
-    elif hasattr(st.session_state, 'current_drug'):
-        report += f"Drug Analysis: {st.session_state.current_drug}\n"
+    elif drug_name is not None:
+        report += f"Drug Analysis: {drug_name}\n"
         
-        if hasattr(st.session_state, 'comprehensive_context'):
+        if drug_context is not None:
             report += "\n=== DRUG INSIGHTS ===\n"
-            report += st.session_state.comprehensive_context
+            report += drug_context
     
     else:
         report += "No data currently loaded for export.\n"
     
-    report += f"""
+    report += """
 
 === DATA SOURCES ===
 - OpenPrescribing.net API
@@ -197,6 +457,31 @@ Contact: support@nhsdatahub.co.uk
     
     return report
 
+def generate_summary_report(generated_at):
+    """Generate a text summary report"""
+    # Only the header carries the current time, so the cached body stays reusable
+    report = f"""
+NHS Prescribing Data Analysis Report
+Generated: {generated_at.strftime('%Y-%m-%d %H:%M:%S')}
+
+=== EXECUTIVE SUMMARY ===
+
+"""
+    return report + build_summary_report_body(**summary_report_inputs())
+
+def resolve_selected_export(selected):
+    """Return (data, analysis, dataset_name) for the dataset chosen on the selection buttons"""
+    state = st.session_state
+    if selected == "epact":
+        # A streamed large upload only has its preview rows in memory - there is no full frame to export
+        data = None if state.get('uploaded_epact_preview_only') else state.uploaded_epact_data
+        return data, state.get('epact_analysis', {}), "ePACT2_Upload"
+    if selected == "search" and 'current_spending_data' in state:
+        return state.current_spending_data, None, f"Drug_Analysis_{state.current_drug}"
+    if selected == "dashboard":
+        return state.dashboard_data, None, state.get('dashboard_type', 'Dashboard').replace(" ", "_")
+    return None, None, ""
+
 # Main title
 st.title("💾 Export Your Results")
 st.subheader("Get Insights in Your Preferred Format")
@@ -233,28 +518,23 @@ st.header("📊 Available Datasets")
 
 col1, col2, col3 = st.columns(3)
 
-export_data = None
-export_analysis = None
-dataset_name = ""
-
 with col1:
     if has_upload_data:
         data = st.session_state.uploaded_epact_data
-        analysis = getattr(st.session_state, 'epact_analysis', {})
+        analysis = st.session_state.get('epact_analysis', {})
         
         st.markdown("""
         <div class="export-card">
         <h4>📁 ePACT2 Upload Data</h4>
         """, unsafe_allow_html=True)
         
-        st.metric("Records", f"{len(data):,}")
+        st.metric("Records", f"{analysis.get('row_count', len(data)):,}")
         if analysis.get('cost_summary'):
             st.metric("Total Cost", f"£{analysis['cost_summary']['total']:,.0f}")
+        if st.session_state.get('uploaded_epact_preview_only'):
+            st.caption("Large file - analysed in chunks, so only the summary report can be exported")
         
         if st.button("Select ePACT2 Data", type="primary", key="select_epact"):
-            export_data = data
-            export_analysis = analysis
-            dataset_name = "ePACT2_Upload"
             st.session_state.selected_export = "epact"
         
         st.markdown("</div>", unsafe_allow_html=True)
@@ -262,6 +542,8 @@ with col1:
 with col2:
     if has_search_data:
         drug_name = st.session_state.current_drug
+        # Looked up once; both the metric and the select button depend on it
+        spending_data = st.session_state.get('current_spending_data')
         
         st.markdown("""
         <div class="export-card">
@@ -270,14 +552,11 @@ with col2:
         
         st.write(f"**Drug:** {drug_name}")
         
-        if hasattr(st.session_state, 'current_spending_data'):
-            spending_data = st.session_state.current_spending_data
+        if spending_data is not None:
             st.metric("Data Points", len(spending_data))
         
         if st.button("Select Search Data", type="primary", key="select_search"):
-            if hasattr(st.session_state, 'current_spending_data'):
-                export_data = st.session_state.current_spending_data
-                dataset_name = f"Drug_Analysis_{drug_name}"
+            if spending_data is not None:
                 st.session_state.selected_export = "search"
         
         st.markdown("</div>", unsafe_allow_html=True)
@@ -285,7 +564,7 @@ with col2:
 with col3:
     if has_dashboard_data:
         dashboard_data = st.session_state.dashboard_data
-        dashboard_type = getattr(st.session_state, 'dashboard_type', 'Dashboard')
+        dashboard_type = st.session_state.get('dashboard_type', 'Dashboard')
         
         st.markdown("""
         <div class="export-card">
@@ -296,28 +575,21 @@ with col3:
         st.metric("Records", f"{len(dashboard_data):,}")
         
         if st.button("Select Dashboard Data", type="primary", key="select_dashboard"):
-            export_data = dashboard_data
-            dataset_name = dashboard_type.replace(" ", "_")
             st.session_state.selected_export = "dashboard"
         
         st.markdown("</div>", unsafe_allow_html=True)
 
 # If data is selected, show export options
-if export_data is not None or hasattr(st.session_state, 'selected_export'):
-    
-    # Get the data based on selection
-    if hasattr(st.session_state, 'selected_export'):
-        if st.session_state.selected_export == "epact":
-            export_data = st.session_state.uploaded_epact_data
-            export_analysis = getattr(st.session_state, 'epact_analysis', {})
-            dataset_name = "ePACT2_Upload"
-        elif st.session_state.selected_export == "search":
-            if hasattr(st.session_state, 'current_spending_data'):
-                export_data = st.session_state.current_spending_data
-                dataset_name = f"Drug_Analysis_{st.session_state.current_drug}"
-        elif st.session_state.selected_export == "dashboard":
-            export_data = st.session_state.dashboard_data
-            dataset_name = getattr(st.session_state, 'dashboard_type', 'Dashboard').replace(" ", "_")
+selected_export = st.session_state.get('selected_export')
+if selected_export is not None:
+    export_data, export_analysis, dataset_name = resolve_selected_export(selected_export)
+    
+    if selected_export == "epact" and export_data is None:
+        st.warning(
+            f"⚠️ This upload has {export_analysis.get('row_count', 0):,} rows and was analysed in chunks, so only "
+            "a preview is held in memory. The Summary Report covers the whole file; for a data export, "
+            "split the file below 100,000 rows or export directly from ePACT2."
+        )
     
     st.markdown("---")
     st.header("📤 Export Options")
@@ -325,7 +597,7 @@ if export_data is not None or hasattr(st.session_state, 'selected_export'):
     # Format selection
     export_format = st.selectbox(
         "📋 Choose Export Format:",
-        ["Excel (.xlsx)", "CSV", "JSON", "Summary Report (Text)"],
+        ["Excel (.xlsx)", "CSV", "JSON", "Parquet (.parquet)", "Summary Report (Text)"],
         help="Select the format that works best with your tools"
     )
     
@@ -346,20 +618,67 @@ if export_data is not None or hasattr(st.session_state, 'selected_export'):
             help="Prevents overwriting files"
         )
     
+    columnar_json = export_format == "JSON" and st.selectbox(
+        "JSON layout:",
+        ["Records (row-oriented)", "Columnar (compact)"],
+        help="Columnar stores each column as one array - smaller, faster, and suited to DuckDB or polars"
+    ) == "Columnar (compact)"
+    
+    pretty_json = export_format == "JSON" and not columnar_json and st.checkbox(
+        "Pretty-print JSON",
+        value=False,
+        help="Indented output is easier to read but larger and slower to build"
+    )
+    
+    compress_csv = export_format == "CSV" and st.checkbox(
+        "Compress CSV (.csv.gz)",
+        value=False,
+        help="Much smaller download for large datasets; opens in most analytics tools"
+    )
+    
+    # One clock read per render, shared by the filename, file metadata and report header
+    now = datetime.now()
+    
     # Generate filename
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S") if timestamp_filename else ""
+    timestamp = now.strftime("%Y%m%d_%H%M%S") if timestamp_filename else ""
     base_filename = f"{dataset_name}_{timestamp}" if timestamp else dataset_name
     
-    # Export buttons
+    optimize_types = st.checkbox(
+        "Optimize types (faster/smaller)",
+        value=True,
+        help="Narrows integer columns and encodes repeated text before exporting; values are unchanged"
+    )
+    
+    # Export buttons - builders are cached on the data's fingerprint, so widget reruns reuse the file
     st.subheader("💾 Download Your Data")
+    fingerprint = None
+    if export_data is not None:
+        fingerprint = (export_fingerprint(export_data), optimize_types)
+        if optimize_types:
+            export_data = optimize_for_export(fingerprint, export_data)
+    
+    # Very large CSV/Excel exports are split into parts so no single file overwhelms the tools opening it
+    segmented = (
+        export_data is not None
+        and len(export_data) > EXPORT_SEGMENT_ROWS
+        and export_format in ("Excel (.xlsx)", "CSV")
+    )
+    if segmented:
+        st.info(f"📦 {len(export_data):,} records - the export is split into {EXPORT_SEGMENT_ROWS:,}-row CSV files in one zip.")
+    
+    # Built once per render and shared by the download button and the preview
+    report_data = generate_summary_report(now) if export_format == "Summary Report (Text)" else None
     
-    col1, col2, col3, col4 = st.columns(4)
+    col1, col2, col3, col4, col5 = st.columns(5)
     
     with col1:
-        if export_format == "Excel (.xlsx)" and export_data is not None:
+        if export_format == "Excel (.xlsx)" and export_data is not None and not segmented:
+            # The summary sheet shows the time to the minute, so that is all the cache key needs
             excel_data = create_excel_export(
-                export_data, 
-                export_analysis if include_analysis else None
+                (fingerprint, analysis_digest(export_analysis) if include_analysis else None),
+                export_data,
+                export_analysis if include_analysis else None,
+                now.replace(second=0, microsecond=0) if include_analysis else None
             )
             
             st.download_button(
@@ -370,25 +689,41 @@ if export_data is not None or hasattr(st.session_state, 'selected_export'):
                 type="primary",
                 use_container_width=True
             )
+            st.caption(f"Written with {excel_engine(export_data)}")
     
     with col2:
-        if export_format == "CSV" and export_data is not None:
-            csv_data = create_csv_export(export_data)
+        if segmented:
+            zip_data = create_segmented_csv_zip(fingerprint, export_data, dataset_name)
+            
+            st.download_button(
+                label="📦 Download CSV Parts",
+                data=zip_data,
+                file_name=f"{base_filename}.zip",
+                mime="application/zip",
+                type="primary",
+                use_container_width=True
+            )
+        elif export_format == "CSV" and export_data is not None:
+            csv_data = create_csv_export(fingerprint, export_data, compress_csv)
             
             st.download_button(
                 label="📄 Download CSV",
                 data=csv_data,
-                file_name=f"{base_filename}.csv",
-                mime="text/csv",
+                file_name=f"{base_filename}.csv.gz" if compress_csv else f"{base_filename}.csv",
+                mime="application/gzip" if compress_csv else "text/csv",
                 type="primary",
                 use_container_width=True
             )
     
     with col3:
         if export_format == "JSON" and export_data is not None:
-            json_data = create_json_export(
+            json_data, json_metadata = create_json_export(
+                (fingerprint, analysis_digest(export_analysis) if include_analysis else None),
                 export_data,
-                export_analysis if include_analysis else None
+                export_analysis if include_analysis else None,
+                pretty_json,
+                columnar_json,
+                now
             )
             
             st.download_button(
@@ -401,9 +736,20 @@ if export_data is not None or hasattr(st.session_state, 'selected_export'):
             )
     
     with col4:
-        if export_format == "Summary Report (Text)":
-            report_data = generate_summary_report()
+        if export_format == "Parquet (.parquet)" and export_data is not None:
+            parquet_data = create_parquet_export(fingerprint, export_data)
             
+            st.download_button(
+                label="🧱 Download Parquet",
+                data=parquet_data,
+                file_name=f"{base_filename}.parquet",
+                mime="application/vnd.apache.parquet",
+                type="primary",
+                use_container_width=True
+            )
+    
+    with col5:
+        if export_format == "Summary Report (Text)":
             st.download_button(
                 label="📋 Download Report",
                 data=report_data,
@@ -418,9 +764,11 @@ if export_data is not None or hasattr(st.session_state, 'selected_export'):
         st.markdown("---")
         st.header("👀 Export Preview")
         
-        if export_format == "Excel (.xlsx)" or export_format == "CSV":
+        if export_format in ("Excel (.xlsx)", "CSV", "Parquet (.parquet)"):
             st.subheader("Data Preview (First 10 rows)")
-            st.dataframe(export_data.head(10), use_container_width=True)
+            st.dataframe(build_preview_table(fingerprint, export_data), use_container_width=True)
+            if len(export_data.columns) > PREVIEW_MAX_COLUMNS:
+                st.caption(f"Showing the first {PREVIEW_MAX_COLUMNS} of {len(export_data.columns)} columns")
             
             if include_analysis and export_analysis:
                 st.subheader("Analysis Summary")
@@ -435,27 +783,34 @@ if export_data is not None or hasattr(st.session_state, 'selected_export'):
                         st.metric("Total Cost", f"£{export_analysis['cost_summary']['total']:,.0f}")
                 
                 with col3:
-                    quality = export_analysis.get('data_quality', {})
-                    missing_pct = quality.get('missing_values', 0)
-                    st.metric("Data Quality", f"{100-missing_pct:.1f}%")
+                    # quality_pct is the share of non-missing cells; missing_values is a raw cell count
+                    quality_pct = export_analysis.get('data_quality', {}).get('quality_pct')
+                    st.metric("Data Quality", f"{quality_pct:.1f}%" if quality_pct is not None else "N/A")
         
         elif export_format == "JSON":
             st.subheader("JSON Structure Preview")
-            preview_json = {
-                "metadata": {
-                    "export_date": datetime.now().isoformat(),
-                    "record_count": len(export_data),
-                    "columns": list(export_data.columns)
-                },
-                "data": export_data.head(3).to_dict('records'),
-                "note": "... (remaining records truncated for preview)"
-            }
+            # Same metadata and serializers as the downloaded file
+            preview_data = export_data.head(3)
+            if columnar_json:
+                preview_json = {
+                    "metadata": json_metadata,
+                    "schema": json_export_schema(preview_data),
+                    "columns": orjson.loads(json_export_columns(preview_data)),
+                    "note": "... (remaining values truncated for preview)"
+                }
+            else:
+                preview_records = json_export_records(preview_data, pretty_json)
+                preview_json = {
+                    "metadata": json_metadata,
+                    "data": preview_records if pretty_json else orjson.loads(preview_records),
+                    "note": "... (remaining records truncated for preview)"
+                }
             st.json(preview_json)
         
         elif export_format == "Summary Report (Text)":
             st.subheader("Report Preview")
             with st.expander("Show Full Report"):
-                st.text(generate_summary_report())
+                st.text(report_data)
 
 # Advanced export options
 st.markdown("---")
@@ -531,7 +886,9 @@ with st.expander("📊 Best Practices for Data Export"):
     
     **For Power BI/Tableau:**
     - CSV format works best for data import
+    - Parquet is much smaller and faster to load for large datasets
     - JSON format preserves data types
+    - Columnar JSON is smaller and loads straight into DuckDB or polars
     - Include analysis metadata for context
     
     **For Presentations:**
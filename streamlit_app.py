@@ -1,6 +1,4 @@
 import streamlit as st
-import pandas as pd
-import plotly.express as px
 
 # Import Claude integration
 try:
@@ -24,8 +22,11 @@ if claude_available:
 else:
     st.sidebar.error("Claude integration not available. Check utils/claude_integration.py")
 
-# Custom CSS for better styling
-st.markdown("""
+# Static markup - built once per server process and reused on every rerun
+@st.cache_resource
+def page_css():
+    """Return the home page's custom CSS block"""
+    return """
 <style>
 .main-header {
     font-size: 3rem;
@@ -60,7 +61,28 @@ st.markdown("""
     box-shadow: 0 2px 4px rgba(0,0,0,0.1);
 }
 </style>
-""", unsafe_allow_html=True)
+"""
+
+@st.cache_resource
+def complexity_fig():
+    """Build the data access complexity bar chart - its inputs are fixed, so it is built once"""
+    import plotly.express as px
+    data_sources = ['ePACT2', 'OpenPrescribing', 'NHSBSA Open Data', 'NICE', 'Local ICB']
+    complexity_score = [8, 6, 7, 9, 8]
+    
+    fig = px.bar(
+        x=data_sources, 
+        y=complexity_score,
+        title="Current Data Access Complexity",
+        labels={'x': 'Data Source', 'y': 'Complexity Score (1-10)'},
+        color=complexity_score,
+        color_continuous_scale='Reds'
+    )
+    fig.update_layout(showlegend=False, height=400)
+    return fig
+
+# Custom CSS for better styling
+st.markdown(page_css(), unsafe_allow_html=True)
 
 # Header
 st.markdown('<h1 class="main-header">🏥 NHS Data Hub</h1>', unsafe_allow_html=True)
@@ -108,19 +130,7 @@ with col1:
 
 with col2:
     # Create a simple visual showing data fragmentation
-    data_sources = ['ePACT2', 'OpenPrescribing', 'NHSBSA Open Data', 'NICE', 'Local ICB']
-    complexity_score = [8, 6, 7, 9, 8]
-    
-    fig = px.bar(
-        x=data_sources, 
-        y=complexity_score,
-        title="Current Data Access Complexity",
-        labels={'x': 'Data Source', 'y': 'Complexity Score (1-10)'},
-        color=complexity_score,
-        color_continuous_scale='Reds'
-    )
-    fig.update_layout(showlegend=False, height=400)
-    st.plotly_chart(fig, use_container_width=True)
+    st.plotly_chart(complexity_fig(), use_container_width=True)
 
 # Solution Preview
 st.markdown("---")
@@ -0,0 +1,43 @@
+import io
+import unittest
+
+import pandas as pd
+
+from utils.csv_readers import iter_csv_arrow, read_csv_arrow
+
+# Blank, quoted-empty and NA-style text cells in string, numeric and date columns
+CSV_BYTES = (
+    b'drug,actual_cost,date\n'
+    b'x,1.5,2024-01-01\n'
+    b',,\n'
+    b'"",NA,NULL\n'
+    b'NA,2.0,2024-02-01\n'
+    b'null,nan,\n'
+    b'None,3.0,2024-03-01\n'
+    b'<NA>,N/A,2024-04-01\n'
+    b'y,#N/A,2024-05-01\n'
+)
+
+
+class CsvNullCountTest(unittest.TestCase):
+    """The Arrow readers must count the same missing cells as pandas' read_csv"""
+
+    def setUp(self):
+        expected = pd.read_csv(io.BytesIO(CSV_BYTES)).isna().sum()
+        self.expected = {col: int(count) for col, count in expected.items()}
+
+    def test_read_csv_arrow_matches_pandas(self):
+        table = read_csv_arrow(CSV_BYTES)
+        null_counts = {name: column.null_count for name, column in zip(table.column_names, table.columns)}
+        self.assertEqual(null_counts, self.expected)
+
+    def test_iter_csv_arrow_matches_pandas(self):
+        null_counts = dict.fromkeys(self.expected, 0)
+        for chunk in iter_csv_arrow(CSV_BYTES):
+            for col, count in chunk.isna().sum().items():
+                null_counts[col] += int(count)
+        self.assertEqual(null_counts, self.expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,8 +1,83 @@
 import streamlit as st
 import pandas as pd
-from anthropic import Anthropic
-import json
+import numpy as np
+from anthropic import AsyncAnthropic, APIConnectionError, InternalServerError, RateLimitError
+import orjson
+import asyncio
+import hashlib
+import atexit
+import os
+import queue
+import re
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+import zlib
 from datetime import datetime
+from utils.data_helpers import frame_digest, frame_fingerprint
+
+try:
+    from numba import njit
+    numba_available = True
+except ImportError:
+    numba_available = False
+
+CLAUDE_MODEL = "claude-3-sonnet-20240229"
+CLAUDE_MAX_TOKENS = 1000
+
+# Client-side limits, kept under the API's per-minute caps; 429s that still get through back off and retry
+RATE_LIMIT_RPM = 40
+RATE_LIMIT_TPM = 16_000
+RATE_LIMIT_BACKOFF = (5, 15, 60)
+
+# Seconds between polls of a session's pending summary batches, which can run for hours
+BATCH_POLL_INTERVAL = 60
+
+# Answers to a repeated question on an unchanged page are reused for a while rather than re-asked
+RESPONSE_CACHE_TTL = 300
+RESPONSE_CACHE_ENTRIES = 128
+
+# Frames longer than this get their date range from the raw datetime64 values rather than pandas reductions
+LARGE_FRAME_ROWS = 100_000
+
+# Tokens and exchanges of chat history kept in the session; older exchanges move to disk
+CHAT_HISTORY_TOKEN_BUDGET = 8_000
+CHAT_HISTORY_MEMORY_ENTRIES = 5
+CHAT_HISTORY_ARCHIVE_ENTRIES = 50
+# Archived exchanges from every session are pruned past this age (seconds) or total size (bytes)
+CHAT_HISTORY_ARCHIVE_MAX_AGE = 24 * 60 * 60
+CHAT_HISTORY_ARCHIVE_MAX_BYTES = 64 * 1024 * 1024
+
+class RateLimiter:
+    """Token buckets for requests and tokens per minute"""
+    
+    def __init__(self, rpm, tpm):
+        self.rpm = rpm
+        self.tpm = tpm
+        self.requests = float(rpm)
+        self.tokens = float(tpm)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+    
+    def acquire(self, est_tokens):
+        """Block until a request and est_tokens tokens are available, then take them"""
+        est_tokens = min(est_tokens, self.tpm)
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                elapsed = now - self.updated
+                self.updated = now
+                self.requests = min(self.rpm, self.requests + elapsed * self.rpm / 60)
+                self.tokens = min(self.tpm, self.tokens + elapsed * self.tpm / 60)
+                if self.requests >= 1 and self.tokens >= est_tokens:
+                    self.requests -= 1
+                    self.tokens -= est_tokens
+                    return
+                # Sleep just long enough for whichever bucket is short to refill
+                wait = max((1 - self.requests) * 60 / self.rpm, (est_tokens - self.tokens) * 60 / self.tpm)
+            time.sleep(wait)
 
 def initialize_claude():
     """Initialize Claude client"""
@@ -12,15 +87,108 @@ def initialize_claude():
         if not api_key:
             st.sidebar.error("⚠️ Anthropic API key not found. Add it to Streamlit secrets.")
             return None
-        return Anthropic(api_key=api_key)
+        return AsyncAnthropic(api_key=api_key)
     except Exception as e:
         st.sidebar.error(f"Error initializing Claude: {str(e)}")
         return None
 
-def get_page_context():
-    """Get current page context for Claude"""
+if numba_available:
+    @njit(cache=True)
+    def _int_min_max(values, missing):
+        """Min and max of an int64 array in one pass, skipping the missing sentinel"""
+        lo = missing
+        hi = missing
+        for v in values:
+            if v == missing:
+                continue
+            if lo == missing or v < lo:
+                lo = v
+            if hi == missing or v > hi:
+                hi = v
+        return lo, hi
+else:
+    def _int_min_max(values, missing):
+        """Min and max of an int64 array, skipping the missing sentinel"""
+        valid = values[values != missing]
+        if valid.size == 0:
+            return missing, missing
+        return valid.min(), valid.max()
+
+def date_min_max(dates):
+    """Min and max of a date column, read straight off the int64 nanoseconds for large datetime columns"""
+    if len(dates) > LARGE_FRAME_ROWS and isinstance(dates.dtype, np.dtype) and dates.dtype.kind == 'M':
+        # NaT is stored as the smallest int64, so it doubles as the missing marker
+        lo, hi = _int_min_max(dates.to_numpy().view('i8'), np.iinfo(np.int64).min)
+        return pd.Timestamp(np.int64(lo).view(dates.dtype)), pd.Timestamp(np.int64(hi).view(dates.dtype))
+    date_range = dates.agg(['min', 'max'])
+    return date_range['min'], date_range['max']
+
+def dumps_indented(obj):
+    """Serialise context for the prompt and sidebar - orjson handles numpy scalars, anything else falls back to str"""
+    options = orjson.OPT_INDENT_2 | orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+    return orjson.dumps(obj, default=str, option=options).decode('utf-8')
+
+# Session state the page context is built from
+CONTEXT_STATE_KEYS = frozenset({
+    "current_page",
+    "current_drug",
+    "search_performed",
+    "comprehensive_context",
+    "current_drug_analysis",
+    "claude_context_refresh",
+    "registered_dfs"
+})
+
+def register_df(name, df):
+    """Make a page's DataFrame visible in Claude's page context under name"""
+    # The context signature fingerprints registered frames by content, so replacing one is picked up
+    st.session_state.setdefault('registered_dfs', {})[name] = df
+
+def unregister_df(name):
+    """Stop showing a page's DataFrame in Claude's page context"""
+    st.session_state.get('registered_dfs', {}).pop(name, None)
+
+def page_context_signature(state):
+    """Key for the session state the page context is built from - values for scalars, content fingerprints
+    for registered frames, identity for the rest (which the memoised context itself keeps alive)"""
+    signature = []
+    for key, value in sorted(state.items()):
+        if key == 'registered_dfs':
+            value = tuple((name, frame_fingerprint(df)) for name, df in sorted(value.items()))
+        elif not isinstance(value, (str, int, float, bool, type(None))):
+            value = id(value)
+        signature.append((key, value))
+    return tuple(signature)
+
+@st.cache_data(show_spinner=False, max_entries=16)
+def summarize_dataframe(digest, name, _data):
+    """Summarise a registered frame for the page context"""
+    value = _data
+    # Get basic stats from dataframe - a hash stands in for the column list, which
+    # Claude can fetch with the get_dataframe_columns tool when it needs it
+    summary = {
+        "name": name,
+        "shape": value.shape,
+        "cols_hash": hashlib.blake2b(",".join(map(str, value.columns)).encode(), digest_size=8).hexdigest()
+    }
+    
+    # Add sample data for context - one row lookup for the latest values, one reduction for the date range
+    latest_columns = [col for col in ('actual_cost', 'items') if col in value.columns]
+    if latest_columns:
+        latest = value[latest_columns].iloc[-1]
+        if 'actual_cost' in latest.index:
+            summary["latest_cost"] = f"£{latest['actual_cost']:,.0f}"
+        if 'items' in latest.index:
+            summary["latest_items"] = f"{latest['items']:,.0f}"
+    if 'date' in value.columns:
+        first_date, last_date = date_min_max(value['date'])
+        summary["date_range"] = f"{first_date} to {last_date}"
+    
+    return summary
+
+def build_page_context(session_keys, state):
+    """Build the page context from a snapshot of the session state keys it reads"""
     context = {
-        "timestamp": datetime.now().isoformat(),
         "page": "Unknown",
         "data_displayed": "None",
         "charts_visible": [],
@@ -31,55 +199,41 @@ def get_page_context():
     # Get current page from URL or session state
     try:
         # Streamlit doesn't directly expose current page, so we'll use session state
-        if hasattr(st.session_state, 'current_page'):
-            context["page"] = st.session_state.current_page
+        if 'current_page' in state:
+            context["page"] = state['current_page']
         
         # Get any data currently being displayed
-        if hasattr(st.session_state, 'current_drug'):
-            context["user_selections"]["drug"] = st.session_state.current_drug
-            context["current_data_summary"] = f"User is viewing data for {st.session_state.current_drug}"
+        if 'current_drug' in state:
+            context["user_selections"]["drug"] = state['current_drug']
+            context["current_data_summary"] = f"User is viewing data for {state['current_drug']}"
             
-        if hasattr(st.session_state, 'search_performed') and st.session_state.search_performed:
+        if state.get('search_performed'):
             context["user_selections"]["search_performed"] = True
             
         # Look for comprehensive analysis data (this should now work!)
-        if hasattr(st.session_state, 'comprehensive_context'):
-            context["comprehensive_analysis"] = st.session_state.comprehensive_context
+        if 'comprehensive_context' in state:
+            context["comprehensive_analysis"] = state['comprehensive_context']
             context["current_data_summary"] = "Comprehensive drug analysis with 3-year trends, regional benchmarking, and seasonal patterns available"
         
         # Look for current drug analysis
-        if hasattr(st.session_state, 'current_drug_analysis'):
-            context["enhanced_drug_data"] = st.session_state.current_drug_analysis
+        if 'current_drug_analysis' in state:
+            context["enhanced_drug_data"] = state['current_drug_analysis']
             
         # Get all drug-related keys for debugging
-        drug_keys = [key for key in st.session_state.keys() if any(word in key.lower() for word in ['drug', 'analysis', 'comprehensive', 'context'])]
+        drug_keys = [key for key in session_keys if any(word in key.lower() for word in ['drug', 'analysis', 'comprehensive', 'context'])]
         if drug_keys:
             context["debug_session_keys"] = drug_keys
             
         # Add refresh timestamp if available
-        if hasattr(st.session_state, 'claude_context_refresh'):
-            context["last_refresh"] = st.session_state.claude_context_refresh
+        if 'claude_context_refresh' in state:
+            context["last_refresh"] = state['claude_context_refresh']
             
-        # Add any dataframes in session state
+        # Add the dataframes pages have registered for Claude
         data_summary = []
-        for key, value in st.session_state.items():
-            if isinstance(value, pd.DataFrame) and not value.empty:
-                # Get basic stats from dataframe
-                summary = {
-                    "name": key,
-                    "shape": value.shape,
-                    "columns": list(value.columns) if len(value.columns) < 10 else list(value.columns[:10]) + ["..."]
-                }
-                
-                # Add sample data for context
-                if 'actual_cost' in value.columns:
-                    summary["latest_cost"] = f"£{value['actual_cost'].iloc[-1]:,.0f}" if not value.empty else "N/A"
-                if 'items' in value.columns:
-                    summary["latest_items"] = f"{value['items'].iloc[-1]:,.0f}" if not value.empty else "N/A"
-                if 'date' in value.columns:
-                    summary["date_range"] = f"{value['date'].min()} to {value['date'].max()}" if not value.empty else "N/A"
-                
-                data_summary.append(summary)
+        for key, value in state.get('registered_dfs', {}).items():
+            if not value.empty:
+                # The summary cache is shared by every session, so it is keyed on the frame's exact digest
+                data_summary.append(summarize_dataframe(frame_digest(value), key, value))
         
         if data_summary:
             context["data_displayed"] = data_summary
@@ -90,9 +244,79 @@ def get_page_context():
     
     return context
 
-def create_system_prompt():
-    """Create system prompt for NHS data analysis"""
-    return """You are Claude, an AI assistant specialized in NHS data analysis and pharmacy insights. You are integrated into the NHS Data Hub application and can see the current page content and data.
+@st.cache_resource
+def get_claude_loop():
+    """Background event loop that runs every session's Claude calls"""
+    # One long-lived loop, so each session's async client keeps its connection pool across reruns
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, name="claude-loop", daemon=True).start()
+    return loop
+
+def run_async(coro):
+    """Run a coroutine on the Claude event loop and wait for its result"""
+    return asyncio.run_coroutine_threadsafe(coro, get_claude_loop()).result()
+
+@st.cache_resource
+def get_rate_limiter():
+    """Rate limiter shared by every session, since they all spend the same API key's quota"""
+    return RateLimiter(RATE_LIMIT_RPM, RATE_LIMIT_TPM)
+
+async def stream_message(client, chunks, **params):
+    """Stream a response, putting each text delta on the chunks queue, and return the final message"""
+    async with client.messages.stream(**params) as stream:
+        async for text in stream.text_stream:
+            chunks.put(text)
+        return await stream.get_final_message()
+
+def run_streaming(client, on_text, **params):
+    """Stream a response on the Claude event loop, calling on_text with the text so far from this thread"""
+    # Streamlit elements can only be updated from the script thread, so deltas are handed back over a queue
+    chunks = queue.Queue()
+    future = asyncio.run_coroutine_threadsafe(stream_message(client, chunks, **params), get_claude_loop())
+    buffer = ""
+    while not (future.done() and chunks.empty()):
+        try:
+            buffer += chunks.get(timeout=0.1)
+        except queue.Empty:
+            continue
+        on_text(buffer)
+    return future.result()
+
+def create_message(client, on_text=None, **params):
+    """Send a Messages API request through the rate limiter, backing off and retrying on 429s"""
+    # The app's system prompt, roughly four characters per token of messages, plus the whole completion budget
+    message_chars = sum(len(str(m['content'])) for m in params['messages'])
+    est_tokens = params['max_tokens'] + SYSTEM_PROMPT_TOKENS + message_chars / 4
+    
+    for delay in RATE_LIMIT_BACKOFF + (None,):
+        get_rate_limiter().acquire(est_tokens)
+        try:
+            if on_text:
+                return run_streaming(client, on_text, **params)
+            return run_async(client.messages.create(**params))
+        except RateLimitError:
+            if delay is None:
+                raise
+            time.sleep(delay)
+
+def get_page_context():
+    """Get current page context for Claude"""
+    # Only the keys the context reads are looked up - one dict lookup each, not a copy of all session state
+    session_keys = tuple(sorted(key for key in st.session_state.keys() if key != 'claude_page_context'))
+    state = {key: st.session_state[key] for key in CONTEXT_STATE_KEYS.intersection(session_keys)}
+    
+    # Memoised in this session's own state, so a context is never served to another session - built
+    # at most once per state change, shared by the query, the history entry and the sidebar expander
+    signature = (session_keys, page_context_signature(state))
+    memo = st.session_state.get('claude_page_context')
+    if memo is None or memo[0] != signature:
+        memo = (signature, build_page_context(session_keys, state))
+        st.session_state.claude_page_context = memo
+    
+    # The timestamp is added outside the memoised build so it is always current
+    return {"timestamp": datetime.now().isoformat(), **memo[1]}
+
+SYSTEM_PROMPT = """You are Claude, an AI assistant specialized in NHS data analysis and pharmacy insights. You are integrated into the NHS Data Hub application and can see the current page content and data.
 
 Key capabilities:
 - Analyze NHS prescribing data from OpenPrescribing API
@@ -117,30 +341,173 @@ Communication style:
 
 Always start responses by acknowledging what you can see on the current page, then provide relevant analysis or answers."""
 
+# Worked out once at import - roughly four UTF-8 bytes per token, which the rate limiter's estimates share
+SYSTEM_PROMPT_TOKENS = len(SYSTEM_PROMPT.encode('utf-8')) // 4
+
+# The same system block is sent on every request
+SYSTEM_PROMPT_BLOCKS = [{"type": "text", "text": SYSTEM_PROMPT, "cache_control": {"type": "ephemeral"}}]
+
+# Prompt caching needs at least 1024 tokens ahead of a breakpoint
+PROMPT_CACHE_MIN_TOKENS = 1024
+
+DATAFRAME_COLUMNS_TOOL = {
+    "name": "get_dataframe_columns",
+    "description": "List every column of a dataset shown in the page context's Datasets line.",
+    "input_schema": {
+        "type": "object",
+        "properties": {"name": {"type": "string", "description": "The dataset's name from the page context"}},
+        "required": ["name"]
+    }
+}
+
+# Tool round trips allowed per question before Claude must answer from what it has
+MAX_TOOL_ROUNDS = 3
+
+def get_dataframe_columns(name):
+    """Answer a get_dataframe_columns tool call from session state"""
+    value = st.session_state.get(name)
+    if not isinstance(value, pd.DataFrame):
+        return f"No dataset named {name} is loaded."
+    return ", ".join(map(str, value.columns))
+
+def create_system_prompt():
+    """Create system prompt for NHS data analysis, marked for Anthropic prompt caching"""
+    return SYSTEM_PROMPT_BLOCKS
+
 def get_chat_history():
     """Get chat history from session state"""
     if "claude_chat_history" not in st.session_state:
         st.session_state.claude_chat_history = []
     return st.session_state.claude_chat_history
 
+@st.cache_resource
+def get_history_archive_dir():
+    """Private directory, owned by this process, that archived history entries are written to"""
+    # mkdtemp makes it readable by this user only; it is removed when the process exits
+    path = tempfile.mkdtemp(prefix='nhsdatahub-claude-')
+    atexit.register(shutil.rmtree, path, ignore_errors=True)
+    return path
+
+def prune_history_archive(directory):
+    """Delete archived entries past the age limit, then the oldest until the archive fits its size cap"""
+    # Sessions that end never clear their own archives, so the cap is applied across all of them
+    cutoff = time.time() - CHAT_HISTORY_ARCHIVE_MAX_AGE
+    files = []
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            try:
+                stat = entry.stat()
+            except OSError:
+                continue
+            if stat.st_mtime < cutoff:
+                delete_archived_entry(entry.path)
+            else:
+                files.append((stat.st_mtime, stat.st_size, entry.path))
+    
+    total = sum(size for _, size, _ in files)
+    for _, size, path in sorted(files):
+        if total <= CHAT_HISTORY_ARCHIVE_MAX_BYTES:
+            break
+        delete_archived_entry(path)
+        total -= size
+
+def archive_history_entry(entry):
+    """Move a history entry out of session state into a compressed JSON file on disk"""
+    session_id = st.session_state.setdefault("claude_session_id", uuid.uuid4().hex)
+    archive = st.session_state.setdefault("claude_history_archive", [])
+    try:
+        directory = get_history_archive_dir()
+        path = os.path.join(directory, f"{session_id}-{uuid.uuid4().hex[:8]}.json.z")
+        with open(path, 'wb') as f:
+            f.write(zlib.compress(orjson.dumps(entry), 1))
+        prune_history_archive(directory)
+    except OSError:
+        # No writable temp dir - the entry is simply dropped, as before archiving existed
+        return
+    archive.append(path)
+    
+    # Oldest archived exchanges go first once the session's archive is full
+    while len(archive) > CHAT_HISTORY_ARCHIVE_ENTRIES:
+        delete_archived_entry(archive.pop(0))
+
+def delete_archived_entry(path):
+    """Remove an archived history entry's file, if it is still there"""
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+def load_archived_history():
+    """Read the session's archived history entries back from disk, oldest first"""
+    entries = []
+    for path in st.session_state.get("claude_history_archive", []):
+        try:
+            with open(path, 'rb') as f:
+                entries.append(orjson.loads(zlib.decompress(f.read())))
+        except (OSError, zlib.error, orjson.JSONDecodeError):
+            continue
+    return entries
+
+def clear_chat_history():
+    """Empty the session's chat history, including its archive on disk"""
+    st.session_state.claude_chat_history = []
+    for path in st.session_state.pop("claude_history_archive", []):
+        delete_archived_entry(path)
+
+def count_entry_tokens(entry):
+    """Input tokens a history entry costs when it is replayed into a prompt"""
+    # Only the question and answer are replayed; roughly four characters per token,
+    # the same local estimate the rate limiter uses
+    return (len(entry["user"]) + len(entry["claude"])) // 4
+
 def add_to_chat_history(user_message, claude_response):
     """Add message pair to chat history"""
     if "claude_chat_history" not in st.session_state:
         st.session_state.claude_chat_history = []
+    history = st.session_state.claude_chat_history
     
-    st.session_state.claude_chat_history.append({
+    entry = {
         "timestamp": datetime.now().isoformat(),
         "user": user_message,
-        "claude": claude_response,
-        "context": get_page_context()
-    })
+        "claude": claude_response
+    }
+    entry["tokens"] = count_entry_tokens(entry)
+    history.append(entry)
     
-    # Keep only last 10 exchanges to manage memory
-    if len(st.session_state.claude_chat_history) > 10:
-        st.session_state.claude_chat_history = st.session_state.claude_chat_history[-10:]
+    # Session state holds a few exchanges within a token budget - the oldest move to disk,
+    # but the latest exchange always stays
+    while len(history) > 1 and (
+        len(history) > CHAT_HISTORY_MEMORY_ENTRIES
+        or sum(e["tokens"] for e in history) > CHAT_HISTORY_TOKEN_BUDGET
+    ):
+        archive_history_entry(history.pop(0))
+
+def response_cache_key(user_message, context):
+    """Key a question by its text and a fingerprint of the page context it was asked against"""
+    context_bytes = orjson.dumps(
+        {key: value for key, value in context.items() if key != "timestamp"},
+        default=str,
+        option=orjson.OPT_SORT_KEYS | orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+    )
+    return hashlib.blake2b(user_message.encode('utf-8') + b'\0' + context_bytes, digest_size=16).digest()
+
+def cached_response(key):
+    """A previous answer to the same question on the same page, if it is still fresh"""
+    hit = st.session_state.get("claude_response_cache", {}).get(key)
+    if hit and time.monotonic() - hit[0] < RESPONSE_CACHE_TTL:
+        return hit[1]
+    return None
+
+def cache_response(key, response):
+    """Remember an answer, dropping the oldest once the session's cache is full"""
+    cache = st.session_state.setdefault("claude_response_cache", {})
+    cache.pop(key, None)
+    cache[key] = (time.monotonic(), response)
+    while len(cache) > RESPONSE_CACHE_ENTRIES:
+        del cache[next(iter(cache))]
 
-def query_claude(client, user_message):
-    """Send query to Claude with context"""
+def query_claude(client, user_message, placeholder=None):
+    """Send query to Claude with context, streaming the answer into placeholder if one is given"""
     if not client:
         return "⚠️ Claude is not available. Please check your API key configuration."
     
@@ -149,51 +516,161 @@ def query_claude(client, user_message):
         context = get_page_context()
         chat_history = get_chat_history()
         
+        # Same question, same page state - answer from the session's cache without an API call
+        cache_key = response_cache_key(user_message, context)
+        cached = cached_response(cache_key)
+        if cached is not None:
+            return cached
+        
         # Build context message
         context_str = f"""
 Current Page Context:
 - Page: {context.get('page', 'Unknown')}
-- User Selections: {json.dumps(context.get('user_selections', {}), indent=2)}
+- User Selections: {dumps_indented(context.get('user_selections', {}))}
 - Data Summary: {context.get('current_data_summary', 'No data')}
+- Datasets: {orjson.dumps(context.get('data_displayed'), default=str, option=orjson.OPT_SERIALIZE_NUMPY).decode('utf-8')}
 
 Comprehensive Drug Analysis:
 {context.get('comprehensive_analysis', 'No comprehensive analysis available')}
-
-Recent Chat History:
-{json.dumps(chat_history[-3:], indent=2) if chat_history else 'No previous conversation'}
 """
 
-        # Create messages for Claude
-        messages = [
-            {
-                "role": "user",
-                "content": f"""Page Context: {context_str}
-
-User Question: {user_message}
+        # Create messages for Claude - recent exchanges replay as real user/assistant turns, so the
+        # API can cache the conversation prefix, and only the question being asked carries the page context
+        messages = []
+        for exchange in chat_history[-3:]:
+            messages += [
+                {"role": "user", "content": exchange["user"]},
+                {"role": "assistant", "content": [{"type": "text", "text": exchange["claude"] or "(no answer)"}]}
+            ]
+        history_chars = sum(len(exchange["user"]) + len(exchange["claude"]) for exchange in chat_history[-3:])
+        if messages and SYSTEM_PROMPT_TOKENS + history_chars // 4 >= PROMPT_CACHE_MIN_TOKENS:
+            messages[-1]["content"][0]["cache_control"] = {"type": "ephemeral"}
+        
+        # A long page context gets its own cache breakpoint, so follow-up questions on the same page reuse it
+        context_block = {"type": "text", "text": f"Page Context: {context_str}"}
+        if SYSTEM_PROMPT_TOKENS + (history_chars + len(context_str)) // 4 >= PROMPT_CACHE_MIN_TOKENS:
+            context_block["cache_control"] = {"type": "ephemeral"}
+        messages.append({
+            "role": "user",
+            "content": [
+                context_block,
+                {"type": "text", "text": f"""User Question: {user_message}
 
-Please provide a helpful response based on the current page context and any data you can see."""
-            }
-        ]
+Please provide a helpful response based on the current page context and any data you can see."""}
+            ]
+        })
         
         # Call Claude
-        response = client.messages.create(
-            model="claude-3-sonnet-20240229",
-            max_tokens=1000,
+        params = dict(
+            model=CLAUDE_MODEL,
+            max_tokens=CLAUDE_MAX_TOKENS,
             temperature=0.3,
             system=create_system_prompt(),
-            messages=messages
+            tools=[DATAFRAME_COLUMNS_TOOL]
         )
+        on_text = placeholder.markdown if placeholder else None
+        response = create_message(client, on_text, messages=messages, **params)
         
-        claude_response = response.content[0].text
+        # Answer column lookups until Claude replies in text
+        for _ in range(MAX_TOOL_ROUNDS):
+            if response.stop_reason != "tool_use":
+                break
+            tool_results = [
+                {"type": "tool_result", "tool_use_id": block.id, "content": get_dataframe_columns(block.input.get("name", ""))}
+                for block in response.content if block.type == "tool_use"
+            ]
+            messages += [
+                {"role": "assistant", "content": response.content},
+                {"role": "user", "content": tool_results}
+            ]
+            response = create_message(client, on_text, messages=messages, **params)
+        
+        claude_response = "".join(block.text for block in response.content if block.type == "text")
         
         # Add to chat history
         add_to_chat_history(user_message, claude_response)
+        cache_response(cache_key, claude_response)
         
         return claude_response
         
     except Exception as e:
         return f"❌ Error querying Claude: {str(e)}"
 
+def dataset_summary_prompts(context):
+    """One summary prompt per dataset in the page context, keyed by a batch-safe custom_id"""
+    datasets = context.get("data_displayed")
+    if not isinstance(datasets, list):
+        return {}
+    return {
+        re.sub(r'[^a-zA-Z0-9_-]', '_', str(dataset["name"]))[:64]: (
+            "Summarise this NHS prescribing dataset for a pharmacy team in three short bullet points, "
+            f"noting anything worth investigating:\n{dumps_indented(dataset)}"
+        )
+        for dataset in datasets
+    }
+
+def queue_batch_summaries(client, prompts):
+    """Submit summaries nobody is waiting on as one Message Batches job"""
+    # Batches are half price and sit outside the per-minute limits; only live chat uses the Messages API directly
+    batch = run_async(client.messages.batches.create(requests=[
+        {
+            "custom_id": custom_id,
+            "params": {
+                "model": CLAUDE_MODEL,
+                "max_tokens": 300,
+                "system": create_system_prompt(),
+                "messages": [{"role": "user", "content": prompt}]
+            }
+        }
+        for custom_id, prompt in prompts.items()
+    ]))
+    st.session_state.setdefault("pending_batches", []).append(batch.id)
+    # A new batch won't have finished by the next rerun, so its first poll waits a full interval
+    st.session_state.batch_last_polled = time.time()
+
+async def fetch_batch_results(client, batch_id):
+    """Return a finished batch's responses by custom_id, or None while it is still running"""
+    batch = await client.messages.batches.retrieve(batch_id)
+    if batch.processing_status != "ended":
+        return None
+    results = {}
+    async for entry in await client.messages.batches.results(batch_id):
+        if entry.result.type == "succeeded":
+            results[entry.custom_id] = entry.result.message.content[0].text
+        else:
+            # Errored, expired and canceled requests are reported rather than retried
+            results[entry.custom_id] = f"_No summary - the request {entry.result.type}._"
+    return results
+
+def collect_batch_results(client):
+    """Poll pending batches, at most once per BATCH_POLL_INTERVAL, moving finished ones' summaries into session state"""
+    pending = st.session_state.get("pending_batches", [])
+    if not pending or time.time() - st.session_state.get("batch_last_polled", 0) < BATCH_POLL_INTERVAL:
+        return
+    st.session_state.batch_last_polled = time.time()
+    
+    for batch_id in list(pending):
+        try:
+            results = run_async(fetch_batch_results(client, batch_id))
+        except (APIConnectionError, InternalServerError, RateLimitError):
+            # Transient failures are retried at the next poll
+            continue
+        except Exception as e:
+            # A bad id or rejected key won't recover, so the batch is dropped rather than polled forever
+            st.session_state.pending_batches.remove(batch_id)
+            st.session_state.claude_batch_error = f"Dataset summaries could not be fetched: {str(e)}"
+            continue
+        if results is not None:
+            st.session_state.setdefault("claude_batch_summaries", {}).update(results)
+            st.session_state.pending_batches.remove(batch_id)
+
+def history_markdown(exchanges):
+    """Render exchanges newest first as one Markdown block, so the history costs a single element"""
+    return "\n\n---\n\n".join(
+        f"**You:** {exchange['user']}\n\n**Claude:** {exchange['claude'][:200]}..."
+        for exchange in reversed(exchanges)
+    )
+
 def render_claude_sidebar():
     """Render the Claude sidebar interface"""
     with st.sidebar:
@@ -216,16 +693,22 @@ def render_claude_sidebar():
         send_clicked = st.button("💬 Send", key="claude_send", disabled=not user_input)
         
         # Handle both button click and Enter key press
+        streamed = False
         if (send_clicked or user_input) and user_input:
             # Only process if this is a new message (not the same as last processed)
             if not hasattr(st.session_state, 'last_claude_input') or st.session_state.last_claude_input != user_input:
                 st.session_state.last_claude_input = user_input
+                st.markdown("#### 🤖 Claude's Response:")
+                # The answer streams into this placeholder as it is generated
+                placeholder = st.empty()
                 with st.spinner("🤔 Claude is thinking..."):
-                    response = query_claude(st.session_state.claude_client, user_input)
+                    response = query_claude(st.session_state.claude_client, user_input, placeholder)
                     st.session_state.claude_latest_response = response
+                placeholder.markdown(response)
+                streamed = True
         
         # Display latest response
-        if hasattr(st.session_state, 'claude_latest_response'):
+        if not streamed and hasattr(st.session_state, 'claude_latest_response'):
             st.markdown("#### 🤖 Claude's Response:")
             st.markdown(st.session_state.claude_latest_response)
         
@@ -233,19 +716,42 @@ def render_claude_sidebar():
         chat_history = get_chat_history()
         if chat_history:
             with st.expander(f"💬 Chat History ({len(chat_history)} messages)"):
-                for i, exchange in enumerate(reversed(chat_history[-5:])):  # Show last 5
-                    st.markdown(f"**You:** {exchange['user']}")
-                    st.markdown(f"**Claude:** {exchange['claude'][:200]}...")
-                    st.markdown("---")
+                st.markdown(history_markdown(chat_history[-5:]))  # Show last 5
+                
+                # Earlier exchanges are only read back from disk when asked for
+                archived = len(st.session_state.get("claude_history_archive", []))
+                if archived and st.checkbox(f"Show {archived} earlier messages", key="claude_show_archive"):
+                    st.markdown(history_markdown(load_archived_history()))
         
         # Quick context info
+        context = get_page_context()
         with st.expander("🔍 What Claude Can See"):
-            context = get_page_context()
-            st.json(context)
+            st.json(dumps_indented(context))
+        
+        # Dataset summaries go through the Batches API and show up on a later rerun
+        if st.session_state.claude_client:
+            collect_batch_results(st.session_state.claude_client)
+            prompts = dataset_summary_prompts(context)
+            if st.button("📝 Summarise Loaded Data", key="claude_batch_summarise", disabled=not prompts):
+                try:
+                    queue_batch_summaries(st.session_state.claude_client, prompts)
+                    st.caption("Summaries queued - they will appear here once the batch finishes.")
+                except Exception as e:
+                    st.error(f"❌ Error queueing summaries: {str(e)}")
+            elif st.session_state.get("pending_batches"):
+                st.caption("⏳ Dataset summaries are still being prepared...")
+            if st.session_state.get("claude_batch_error"):
+                st.warning(st.session_state.pop("claude_batch_error"))
+        
+        if st.session_state.get("claude_batch_summaries"):
+            with st.expander("📝 Dataset Summaries"):
+                for name, summary in st.session_state.claude_batch_summaries.items():
+                    st.markdown(f"**{name}**")
+                    st.markdown(summary)
         
         # Clear chat button
         if st.button("🗑️ Clear Chat", key="clear_claude_chat"):
-            st.session_state.claude_chat_history = []
+            clear_chat_history()
             if hasattr(st.session_state, 'claude_latest_response'):
                 del st.session_state.claude_latest_response
             st.rerun()
\ No newline at end of file
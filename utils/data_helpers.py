@@ -0,0 +1,127 @@
+import streamlit as st
+import requests
+import hashlib
+import threading
+from collections import OrderedDict
+import orjson
+import pandas as pd
+import numpy as np
+
+# Fields used from the spending_by_org response and their compact Arrow-backed dtypes
+ICB_COLUMNS = ('date', 'actual_cost', 'items', 'row_name', 'name', 'row_id')
+NUMERIC_DTYPES = {'actual_cost': 'float64[pyarrow]', 'items': 'int32[pyarrow]'}
+CATEGORY_COLUMNS = ('name', 'row_name', 'drug_name')
+
+# Conditional-GET payloads kept for revalidation; each drug search adds keys, so the oldest are evicted
+VALIDATOR_STORE_ENTRIES = 32
+
+class ValidatorStore:
+    """Least-recently-used map of ETag/Last-Modified validators and payloads, safe to share across sessions"""
+    
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+    
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+            return entry
+    
+    def put(self, key, entry):
+        with self.lock:
+            self.entries[key] = entry
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+# Helper functions for API calls
+@st.cache_resource
+def get_validator_store():
+    """Shared store of ETag/Last-Modified validators and payloads keyed by URL and params"""
+    return ValidatorStore(VALIDATOR_STORE_ENTRIES)
+
+def get_openprescribing_data(endpoint, params=None):
+    """Fetch data from OpenPrescribing API"""
+    base_url = "https://openprescribing.net/api/1.0"
+    url = f"{base_url}/{endpoint}"
+    
+    # Revalidate with a conditional GET so an unchanged payload comes back as a 304
+    store = get_validator_store()
+    key = (url, tuple(sorted((params or {}).items())))
+    cached = store.get(key)
+    headers = {}
+    if cached:
+        if cached['etag']:
+            headers['If-None-Match'] = cached['etag']
+        if cached['last_modified']:
+            headers['If-Modified-Since'] = cached['last_modified']
+    
+    try:
+        response = requests.get(url, params=params, headers=headers, timeout=10)
+        if response.status_code == 304 and cached:
+            return cached['data']
+        response.raise_for_status()
+        # orjson parses the raw bytes considerably faster than response.json()
+        data = orjson.loads(response.content)
+        etag = response.headers.get('ETag')
+        last_modified = response.headers.get('Last-Modified')
+        if etag or last_modified:
+            store.put(key, {'etag': etag, 'last_modified': last_modified, 'data': data})
+        return data
+    except (requests.exceptions.RequestException, orjson.JSONDecodeError) as e:
+        st.error(f"Error fetching data: {str(e)}")
+        return None
+
+@st.cache_data(ttl=3600)  # Cache for 1 hour
+def fetch_raw_data(endpoint, params, columns=None):
+    """Fetch an OpenPrescribing endpoint as an untrimmed DataFrame with dates parsed"""
+    data = get_openprescribing_data(endpoint, params)
+    if data:
+        if columns:
+            # Keep only the fields we use
+            df = pd.DataFrame(data, columns=[c for c in columns if c in data[0]])
+        else:
+            df = pd.DataFrame(data)
+        # Arrow-backed types let groupby sums use Arrow kernels; costs stay float64 so totals and exports
+        # keep their pence, and are only narrowed to float32 for chart payloads
+        df = df.astype({c: t for c, t in NUMERIC_DTYPES.items() if c in df.columns})
+        # Names repeat every month; categorical codes make the groupby hash cheap
+        for col in CATEGORY_COLUMNS:
+            if col in df.columns:
+                df[col] = df[col].astype('category')
+        if not df.empty and 'date' in df.columns and not pd.api.types.is_datetime64_any_dtype(df['date']):
+            # OpenPrescribing returns ISO dates, so skip per-value format inference
+            df['date'] = pd.to_datetime(df['date'], format='%Y-%m-%d', cache=True)
+        return df
+    
+    return pd.DataFrame()
+
+def top_k(df, col, k):
+    """Return the k rows with the largest values in col, largest first"""
+    values = df[col].to_numpy()
+    if len(values) <= k:
+        return df.iloc[np.argsort(-values, kind='stable')]
+    # Partition in O(n) and only sort the k survivors
+    idx = np.argpartition(-values, k - 1)[:k]
+    return df.iloc[idx[np.argsort(-values[idx], kind='stable')]]
+
+def frame_fingerprint(data):
+    """Cheap content key for a frame - shape, columns, dtypes and a hash of the first and last rows.
+    Approximate, so only for keys where a false hit does no harm; use frame_digest for shared caches."""
+    edges = pd.concat([data.head(100), data.tail(100)]) if len(data) > 200 else data
+    return (
+        data.shape,
+        tuple(map(str, data.columns)),
+        tuple(map(str, data.dtypes)),
+        int(pd.util.hash_pandas_object(edges, index=True).sum())
+    )
+
+def frame_digest(data):
+    """Exact content key for a frame - every value and index label, in row order"""
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(orjson.dumps([list(map(str, data.columns)), list(map(str, data.dtypes))]))
+    digest.update(pd.util.hash_pandas_object(data, index=True).to_numpy().tobytes())
+    return digest.hexdigest()